@@ -0,0 +1,481 @@
+import keyword
+import math
+import os
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import chain, islice
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖，缺失时用 list / array.array 分块
+    np = None
+
+
+# 与 2.生成器.py 中相同的逐项生成器
+def filter_even(numbers):
+    for n in numbers:
+        if n % 2 == 0:
+            yield n
+
+
+def square(numbers):
+    for n in numbers:
+        yield n**2
+
+
+def chunks_of(iterable, size=65536, kind="list"):
+    """把任意可迭代对象切成块
+
+    Args:
+        kind: "list"、"array"（array.array('q')）或 "numpy"
+    """
+    if kind == "numpy" and isinstance(iterable, range) and iterable.step == 1:
+        # range 直接按块生成 ndarray，不经过 Python 对象
+        for start in range(iterable.start, iterable.stop, size):
+            yield np.arange(start, min(start + size, iterable.stop), dtype=np.int64)
+        return
+    it = iter(iterable)
+    while True:
+        block = list(islice(it, size))
+        if not block:
+            return
+        if kind == "numpy":
+            yield np.asarray(block)
+        elif kind == "array":
+            yield array("q", block)
+        else:
+            yield block
+
+
+def _rebuild(chunk, values):
+    """按输入块的类型构造输出块"""
+    if isinstance(chunk, array):
+        values = values if isinstance(values, list) else list(values)
+        try:
+            return array(chunk.typecode, values)
+        except (TypeError, OverflowError):
+            return values
+    return values if isinstance(values, list) else list(values)
+
+
+class Map:
+    """映射阶段
+
+    Args:
+        func: 逐项函数，兜底时配合 C 层的 map 使用
+        vectorized: ndarray 块的整块实现，如 lambda a: a * a
+        batch: list/array 块的整块实现（通常是列表推导式），省掉逐项函数调用
+    """
+
+    def __init__(self, func, vectorized=None, batch=None):
+        self.func = func
+        self.vectorized = vectorized
+        self.batch = batch
+
+    def __call__(self, chunks):
+        func, vectorized, batch = self.func, self.vectorized, self.batch
+        for chunk in chunks:
+            if vectorized is not None and np is not None and isinstance(chunk, np.ndarray):
+                yield vectorized(chunk)
+            elif batch is not None:
+                yield _rebuild(chunk, batch(chunk))
+            else:
+                yield _rebuild(chunk, map(func, chunk))
+
+
+class Filter:
+    """过滤阶段
+
+    Args:
+        predicate: 逐项谓词，兜底时配合 C 层的 filter 使用
+        mask: ndarray 块的布尔掩码实现，如 lambda a: a % 2 == 0
+        batch: list/array 块的整块实现（通常是列表推导式）
+    """
+
+    def __init__(self, predicate, mask=None, batch=None):
+        self.predicate = predicate
+        self.mask = mask
+        self.batch = batch
+
+    def __call__(self, chunks):
+        predicate, mask, batch = self.predicate, self.mask, self.batch
+        for chunk in chunks:
+            if mask is not None and np is not None and isinstance(chunk, np.ndarray):
+                yield chunk[mask(chunk)]
+            elif batch is not None:
+                yield _rebuild(chunk, batch(chunk))
+            else:
+                yield _rebuild(chunk, filter(predicate, chunk))
+
+
+class Adapt:
+    """把现有的逐项生成器函数接入分块管道
+
+    先把块展平交给生成器（因此有状态的生成器也能正确工作），再把输出重新分块。
+    """
+
+    def __init__(self, generator_func, chunk_size=65536):
+        self.generator_func = generator_func
+        self.chunk_size = chunk_size
+
+    def __call__(self, chunks):
+        return chunks_of(self.generator_func(chain.from_iterable(chunks)), self.chunk_size)
+
+
+class ChunkedPipeline:
+    """阶段之间传递的是块而不是单个元素，逐项开销按块摊薄"""
+
+    def __init__(self, *stages, chunk_size=65536, kind=None):
+        self.stages = list(stages)
+        self.chunk_size = chunk_size
+        self.kind = kind or ("numpy" if np is not None else "list")
+
+    def then(self, stage):
+        self.stages.append(stage)
+        return self
+
+    def chunks(self, source):
+        """逐块产出结果"""
+        stream = chunks_of(source, self.chunk_size, self.kind)
+        for stage in self.stages:
+            stream = stage(stream)
+        return stream
+
+    def __call__(self, source):
+        """逐项产出结果，可以像普通生成器一样接在其他管道后面"""
+        for chunk in self.chunks(source):
+            yield from (chunk.tolist() if np is not None and isinstance(chunk, np.ndarray) else chunk)
+
+
+def _square_array(a):
+    """ndarray 块求平方
+
+    整数 dtype 的乘法溢出时会静默回绕（int64 下 |n| > 3037000499 即溢出），
+    超出范围的块改用 Python int 计算，得到 object 数组，结果与逐项 n**2 一致。
+    """
+    if a.dtype.kind in "iu" and a.size:
+        limit = math.isqrt(np.iinfo(a.dtype).max)
+        if a.max() > limit or (a.dtype.kind == "i" and a.min() < -limit):
+            return np.array([n * n for n in a.tolist()], dtype=object)
+    return a * a
+
+
+# 内置的向量化阶段，对应 filter_even / square
+even = Filter(lambda n: n % 2 == 0,
+              mask=lambda a: a % 2 == 0,
+              batch=lambda c: [n for n in c if n % 2 == 0])
+squared = Map(lambda n: n**2,
+              vectorized=_square_array,
+              batch=lambda c: [n * n for n in c])
+
+
+def _apply_each(func, batch):
+    """在子进程中逐项调用 func（必须是模块顶层函数才能被 pickle）"""
+    return [func(item) for item in batch]
+
+
+def _apply_generator(generator_func, batch):
+    """在子进程中把整批交给逐项生成器函数，如 square"""
+    return list(generator_func(batch))
+
+
+class ProcessStage:
+    """把批次交给 ProcessPoolExecutor 的管道阶段
+
+    - 同时在途的批次不超过 max_in_flight，上游不会被一次性读空
+    - ordered=True 按输入顺序产出；False 时哪批先完成先产出
+    - 本身是普通生成器函数，可直接接在 square(filter_even(...)) 这样的链中
+
+    Args:
+        func: 模块顶层的逐项函数；generator=True 时为逐项生成器函数
+    """
+
+    def __init__(self, func, batch_size=10_000, max_in_flight=None, ordered=True,
+                 workers=None, generator=False):
+        self.func = func
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.ordered = ordered
+        self.apply = _apply_generator if generator else _apply_each
+
+    def map_chunks(self, chunks):
+        """按块处理，输出也是块；可作为 ChunkedPipeline 的阶段"""
+        with ProcessPoolExecutor(self.workers) as pool:
+            pending = deque() if self.ordered else set()
+            for chunk in chunks:
+                if len(pending) >= self.max_in_flight:
+                    yield from self._drain(pending, one=True)
+                future = pool.submit(self.apply, self.func, list(chunk))
+                if self.ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+            yield from self._drain(pending)
+
+    def _drain(self, pending, one=False):
+        while pending:
+            if self.ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    yield future.result()
+            if one:
+                return
+
+    def __call__(self, items):
+        for chunk in self.map_chunks(chunks_of(items, self.batch_size)):
+            yield from chunk
+
+
+def cpu_heavy(n):
+    """模拟 CPU 密集型的逐项处理"""
+    total = 0
+    for i in range(200):
+        total += (n * i) % 7
+    return total
+
+
+def benchmark_process_stage(n=40_000):
+    """对比单进程生成器与多进程阶段（有序/无序）"""
+    def serial(numbers):
+        for x in numbers:
+            yield cpu_heavy(x)
+
+    cases = {
+        "单进程生成器": lambda: sum(serial(range(n))),
+        "ProcessStage 有序": lambda: sum(ProcessStage(cpu_heavy, batch_size=2_000)(range(n))),
+        "ProcessStage 无序": lambda: sum(ProcessStage(cpu_heavy, batch_size=2_000, ordered=False)(range(n))),
+    }
+    print(f"  CPU 核数: {os.cpu_count()}")
+    for label, fn in cases.items():
+        start = time.perf_counter()
+        total = fn()
+        elapsed = time.perf_counter() - start
+        print(f"  {label}: 结果 {total}, {elapsed:.2f}s, {n / elapsed:.0f} 项/秒")
+
+
+def benchmark_pipelines(n=2_000_000):
+    """对比逐项生成器链与分块管道的吞吐（元素/秒按输入计）"""
+    def drain(chunks):
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+        return total
+
+    cases = {
+        "square(filter_even(...))": lambda: sum(1 for _ in square(filter_even(range(n)))),
+        "分块 list": lambda: drain(ChunkedPipeline(even, squared, kind="list").chunks(range(n))),
+        "分块 array.array": lambda: drain(ChunkedPipeline(even, squared, kind="array").chunks(range(n))),
+        "适配器接入原生成器": lambda: drain(
+            ChunkedPipeline(Adapt(filter_even), Adapt(square), kind="list").chunks(range(n))),
+    }
+    if np is not None:
+        cases["分块 NumPy"] = lambda: drain(ChunkedPipeline(even, squared, kind="numpy").chunks(range(n)))
+    else:
+        print("  未安装 NumPy，跳过向量化路径")
+    for label, fn in cases.items():
+        start = time.perf_counter()
+        produced = fn()
+        elapsed = time.perf_counter() - start
+        print(f"  {label}: {produced} 个结果, {elapsed:.3f}s, {n / elapsed / 1e6:.1f}M 元素/秒")
+
+
+_FUSED_CACHE_SIZE = 256
+_fused_cache = OrderedDict()  # 阶段形状 -> (融合函数, 源码)，按最近使用淘汰
+
+# 生成的融合函数里已经占用的名字
+_FUSED_RESERVED = frozenset({"x", "source", "env"})
+
+
+def _check_env_names(names):
+    """env 的键会作为变量名拼进生成的源码，只接受普通标识符"""
+    for name in names:
+        if (not isinstance(name, str) or not name.isidentifier() or keyword.iskeyword(name)
+                or name in _FUSED_RESERVED or (name.startswith("_f") and name[2:].isdigit())):
+            raise ValueError(f"env 中的名字不能用作变量: {name!r}")
+
+
+def _map_stage(func, items):
+    for x in items:
+        yield func(x)
+
+
+def _filter_stage(predicate, items):
+    for x in items:
+        if predicate(x):
+            yield x
+
+
+class FusedPipeline:
+    """逐项管道：把相邻的 map / filter 阶段融合成一个生成的循环
+
+    每多一层生成器，每个元素就要多一次 next() 和一次帧切换。这里把连续的
+    map / filter 阶段编译成一个 for 循环；阶段既可以是函数，也可以是以 x 为变量的
+    表达式字符串（如 "x * x"），后者会直接内联进循环，连函数调用也省掉。
+    then() 接入的生成器函数无法融合（可能有状态），在它前后把管道切成几段，
+    段与段之间仍按普通生成器链接。
+
+    Args:
+        env: 表达式字符串中可以引用的名字，如 {"math": math}
+    """
+
+    def __init__(self, env=None):
+        self.env = dict(env or {})
+        _check_env_names(self.env)
+        self._stages = []  # (kind, op)，kind 为 "map" / "filter" / "generator"
+
+    def map(self, op):
+        self._stages.append(("map", op))
+        return self
+
+    def filter(self, op):
+        self._stages.append(("filter", op))
+        return self
+
+    def then(self, generator_func):
+        self._stages.append(("generator", generator_func))
+        return self
+
+    def _segments(self):
+        """按 generator 阶段切分：连续的 map / filter 为一段可融合的列表"""
+        segments, current = [], []
+        for kind, op in self._stages:
+            if kind == "generator":
+                if current:
+                    segments.append(current)
+                    current = []
+                segments.append(op)
+            else:
+                current.append((kind, op))
+        if current:
+            segments.append(current)
+        return segments
+
+    def _compile(self, segment):
+        """生成并编译融合循环；按阶段形状缓存，相同形状只编译一次"""
+        funcs = [op for _, op in segment if not isinstance(op, str)]
+        key = (tuple((kind, op if isinstance(op, str) else None) for kind, op in segment),
+               tuple(sorted(self.env)))
+        cached = _fused_cache.get(key)
+        if cached is not None:
+            _fused_cache.move_to_end(key)
+        else:
+            _check_env_names(self.env)  # env 是公开属性，创建后可能被改过
+            params = [f"_f{i}" for i in range(len(funcs))]
+            lines = [f"def _fused(source, {''.join(p + ', ' for p in params)}env):",
+                     *[f"    {name} = env[{name!r}]" for name in sorted(self.env)],
+                     "    for x in source:"]
+            slots = iter(params)
+            for kind, op in segment:
+                expr = op if isinstance(op, str) else f"{next(slots)}(x)"
+                if kind == "map":
+                    lines.append(f"        x = {expr}")
+                else:
+                    lines.append(f"        if not ({expr}):")
+                    lines.append("            continue")
+            lines.append("        yield x")
+            source = "\n".join(lines)
+            namespace = {}
+            exec(compile(source, "<fused>", "exec"), namespace)
+            cached = _fused_cache[key] = (namespace["_fused"], source)
+            if len(_fused_cache) > _FUSED_CACHE_SIZE:
+                _fused_cache.popitem(last=False)
+        return cached[0], cached[1], funcs
+
+    def __call__(self, source):
+        items = iter(source)
+        for segment in self._segments():
+            if callable(segment):
+                items = segment(items)
+            else:
+                fused, _, funcs = self._compile(segment)
+                items = fused(items, *funcs, self.env)
+        return items
+
+    def chained(self, source):
+        """不融合的参照实现：每个阶段一层生成器，用于对比和校验"""
+        items = iter(source)
+        for kind, op in self._stages:
+            if kind == "generator":
+                items = op(items)
+                continue
+            func = eval(f"lambda x: {op}", dict(self.env)) if isinstance(op, str) else op
+            items = _map_stage(func, items) if kind == "map" else _filter_stage(func, items)
+        return items
+
+    def explain(self):
+        """返回融合后的执行计划：每段是融合循环的源码或未融合的生成器"""
+        parts = []
+        for i, segment in enumerate(self._segments()):
+            if callable(segment):
+                name = getattr(segment, "__name__", repr(segment))
+                parts.append(f"段 {i}: 生成器 {name}（未融合）")
+            else:
+                _, source, _ = self._compile(segment)
+                parts.append(f"段 {i}: 融合 {len(segment)} 个阶段\n{source}")
+        return "\n".join(parts)
+
+
+def benchmark_fusion(n=200_000, max_stages=10):
+    """2~max_stages 个阶段：逐层生成器链 vs 融合（函数阶段）vs 融合（表达式内联）"""
+    add_one = lambda x: x + 1  # noqa: E731
+    non_negative = lambda x: x >= 0  # noqa: E731
+    for count in range(2, max_stages + 1, 2):
+        with_funcs, with_exprs = FusedPipeline(), FusedPipeline()
+        for i in range(count):
+            if i % 2:
+                with_funcs.filter(non_negative)
+                with_exprs.filter("x >= 0")
+            else:
+                with_funcs.map(add_one)
+                with_exprs.map("x + 1")
+        timings = []
+        for label, fn in (("生成器链", lambda: with_funcs.chained(range(n))),
+                          ("融合", lambda: with_funcs(range(n))),
+                          ("融合+内联", lambda: with_exprs(range(n)))):
+            start = time.perf_counter()
+            deque(fn(), maxlen=0)
+            timings.append(f"{label} {n / (time.perf_counter() - start) / 1e6:.1f}M/s")
+        print(f"  {count} 个阶段: " + ", ".join(timings))
+
+
+# 使用多进程时子进程会重新导入本模块，演示代码放在 __main__ 保护下
+if __name__ == "__main__":
+    print("------------分块管道------------")
+    numbers = range(20)
+    print(list(square(filter_even(numbers))))
+    print(list(ChunkedPipeline(even, squared, chunk_size=4)(numbers)))
+    print(list(ChunkedPipeline(Adapt(filter_even), squared, chunk_size=4, kind="array")(numbers)))
+    large = [3_037_000_499, 3_037_000_500, -(2**40), 2**62]
+    for kind in ("list", "array", "numpy") if np is not None else ("list", "array"):
+        assert list(ChunkedPipeline(squared, kind=kind)(large)) == [n**2 for n in large], kind
+    print(f"超出 int64 平方范围的值: {list(ChunkedPipeline(squared)(large[1:2]))}")
+    benchmark_pipelines()
+
+    print("\n------------管道融合------------")
+    pipeline = FusedPipeline().filter("x % 2 == 0").map("x ** 2").then(filter_even).map(str)
+    print(list(pipeline(range(20))))
+    print(pipeline.explain())
+    assert list(pipeline(range(1000))) == list(pipeline.chained(range(1000)))
+    for bad in ({"import os; x": 1}, {"lambda": 1}, {"x": 1}):
+        try:
+            FusedPipeline(env=bad)
+        except ValueError as error:
+            print(f"拒绝: {error}")
+        else:
+            raise AssertionError(f"应当拒绝 {bad}")
+    for i in range(_FUSED_CACHE_SIZE + 10):
+        FusedPipeline().map(f"x + {i}")(range(1))
+    print(f"融合缓存: {len(_fused_cache)} 项 (上限 {_FUSED_CACHE_SIZE})")
+    benchmark_fusion()
+
+    print("\n------------多进程管道阶段------------")
+    # 多进程阶段直接接在原有的生成器链中
+    print(list(ProcessStage(square, batch_size=3, generator=True)(filter_even(range(20)))))
+    print(sorted(ProcessStage(cpu_heavy, batch_size=4, ordered=False)(range(10))))
+    benchmark_process_stage()
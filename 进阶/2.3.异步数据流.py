@@ -0,0 +1,1035 @@
+import asyncio
+import hashlib
+import heapq
+import math
+import platform
+import random
+import struct
+import time
+from array import array
+from bisect import bisect_right
+from collections import deque
+
+
+# 模拟数据流生成器（异步版本）
+async def data_stream(interval=0.0, limit=None):
+    """异步产出 {"timestamp", "value"} 记录；interval 为产出间隔，limit 为条数上限"""
+    count = 0
+    while limit is None or count < limit:
+        yield {"timestamp": time.time(), "value": random.random() * 100}
+        count += 1
+        # interval 为 0 时也让出一次事件循环，避免饿死消费者
+        await asyncio.sleep(interval)
+
+
+_CLOSED = object()
+
+
+class BoundedChannel:
+    """有界通道：缓冲区满时按策略施加背压
+
+    policy:
+        "block": 生产者等待，直到有空位
+        "drop_oldest": 丢弃最旧的一条，为新数据腾位置
+        "sample": 缓冲区满时每 sample_every 条只保留 1 条（替换最旧的），其余丢弃
+    """
+
+    POLICIES = ("block", "drop_oldest", "sample")
+
+    def __init__(self, maxsize=1024, policy="block", sample_every=10, name=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"未知的背压策略: {policy}")
+        self.name = name
+        self.policy = policy
+        self.sample_every = sample_every
+        self._queue = asyncio.Queue(maxsize)
+        self._overflow = 0
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.closed = False
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    async def put(self, item):
+        queue = self._queue
+        self.put_count += 1
+        if queue.full() and self.policy != "block":
+            self._overflow += 1
+            if self.policy == "sample" and self._overflow % self.sample_every:
+                self.dropped += 1
+                return
+            queue.get_nowait()  # 丢弃最旧的
+            self.dropped += 1
+        await queue.put(item)
+        if queue.qsize() > self.max_depth:
+            self.max_depth = queue.qsize()
+
+    async def close(self):
+        """发送结束标记；结束标记不受背压策略影响"""
+        self.closed = True
+        await self._queue.put(_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is _CLOSED:
+            raise StopAsyncIteration
+        return item
+
+    def metrics(self):
+        return {
+            "policy": self.policy,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "put": self.put_count,
+            "dropped": self.dropped,
+        }
+
+
+class StreamRuntime:
+    """极简的流运行时：阶段之间用有界通道连接，支持扇出到多个消费者"""
+
+    def __init__(self):
+        self.channels = []
+        self._tasks = []
+
+    def channel(self, maxsize=1024, policy="block", **kwargs):
+        ch = BoundedChannel(maxsize, policy, name=f"ch{len(self.channels)}", **kwargs)
+        self.channels.append(ch)
+        return ch
+
+    def _spawn(self, coro):
+        self._tasks.append(coro)
+
+    def source(self, agen, maxsize=1024, policy="block", **kwargs):
+        """把异步生成器接入通道"""
+        out = self.channel(maxsize, policy, **kwargs)
+
+        async def pump():
+            try:
+                async for item in agen:
+                    await out.put(item)
+            finally:
+                await out.close()
+
+        self._spawn(pump())
+        return out
+
+    def map(self, inbox, func, maxsize=1024, policy="block", **kwargs):
+        """映射阶段；func 可以是普通函数或协程函数"""
+        out = self.channel(maxsize, policy, **kwargs)
+        is_async = asyncio.iscoroutinefunction(func)
+
+        async def run():
+            try:
+                async for item in inbox:
+                    await out.put(await func(item) if is_async else func(item))
+            finally:
+                await out.close()
+
+        self._spawn(run())
+        return out
+
+    def fan_out(self, inbox, policies, maxsize=1024, **kwargs):
+        """把一个通道复制到多个通道，每个下游通道使用 policies 中对应的背压策略
+
+        下游为 "block" 时，慢消费者会把背压传回上游；其他策略只影响自己的通道。
+        """
+        outs = [self.channel(maxsize, policy, **kwargs) for policy in policies]
+
+        async def run():
+            try:
+                async for item in inbox:
+                    for out in outs:
+                        await out.put(item)
+            finally:
+                for out in outs:
+                    await out.close()
+
+        self._spawn(run())
+        return outs
+
+    def consume(self, inbox, handler):
+        """消费通道；handler 可以是普通函数或协程函数"""
+        is_async = asyncio.iscoroutinefunction(handler)
+
+        async def run():
+            async for item in inbox:
+                if is_async:
+                    await handler(item)
+                else:
+                    handler(item)
+
+        self._spawn(run())
+
+    async def run(self):
+        await asyncio.gather(*self._tasks)
+
+    def metrics(self):
+        """各通道的队列深度、最大深度和丢弃数"""
+        return {ch.name: ch.metrics() for ch in self.channels}
+
+
+async def demo(records=2000):
+    """快速生产者 + 三个速度不同的消费者"""
+    runtime = StreamRuntime()
+    source = runtime.source(data_stream(limit=records), maxsize=256)
+    rounded = runtime.map(source, lambda r: {**r, "value": round(r["value"], 1)}, maxsize=256)
+    fast_in, latest_in, sampled_in = runtime.fan_out(
+        rounded, ("block", "drop_oldest", "sample"), maxsize=64)
+    received = {"fast": 0, "latest": 0, "sampled": 0}
+
+    def make_consumer(name, delay):
+        async def consumer(item):
+            received[name] += 1
+            await asyncio.sleep(delay)
+        return consumer
+
+    runtime.consume(fast_in, make_consumer("fast", 0))
+    runtime.consume(latest_in, make_consumer("latest", 0.002))
+    runtime.consume(sampled_in, make_consumer("sampled", 0.002))
+    start = time.perf_counter()
+    await runtime.run()
+    print(f"处理 {records} 条记录用时 {time.perf_counter() - start:.2f}s, 各消费者收到: {received}")
+    for name, m in runtime.metrics().items():
+        print(f"  {name}: {m}")
+
+
+class WindowStats:
+    """窗口内的增量统计：每条记录 O(1) 更新 count/sum/min/max"""
+
+    __slots__ = ("count", "sum", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def result(self, start, end):
+        return {"start": start, "end": end, "count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "min": self.min, "max": self.max}
+
+
+class MonotonicAggregate:
+    """支持从队首淘汰的滑动聚合
+
+    sum 随进出累加累减，用 Neumaier 补偿求和记下每次加减丢掉的低位，大值进出窗口后
+    小值之和不会被吞掉；每淘汰约一个窗口的记录再用 math.fsum 精确重算一次，
+    长时间运行的误差不会累积（重算均摊到每条记录仍是 O(1)）。
+    min/max 各用一个单调双端队列维护，每条记录最多入队出队一次，均摊 O(1)。
+    """
+
+    def __init__(self):
+        self.items = deque()
+        self._sum = 0.0
+        self._compensation = 0.0
+        self._evicted = 0  # 上次精确重算以来淘汰的记录数
+        self._min = deque()
+        self._max = deque()
+
+    @property
+    def sum(self):
+        return self._sum + self._compensation
+
+    def _accumulate(self, value):
+        total = self._sum + value
+        if abs(self._sum) >= abs(value):
+            self._compensation += (self._sum - total) + value
+        else:
+            self._compensation += (value - total) + self._sum
+        self._sum = total
+
+    def push(self, timestamp, value):
+        entry = (timestamp, value)
+        self.items.append(entry)
+        self._accumulate(value)
+        while self._min and self._min[-1][1] > value:
+            self._min.pop()
+        self._min.append(entry)
+        while self._max and self._max[-1][1] < value:
+            self._max.pop()
+        self._max.append(entry)
+
+    def evict_until(self, cutoff):
+        """淘汰时间戳 <= cutoff 的记录"""
+        items = self.items
+        evicted = 0
+        while items and items[0][0] <= cutoff:
+            entry = items.popleft()
+            self._accumulate(-entry[1])
+            evicted += 1
+            if self._min[0] is entry:
+                self._min.popleft()
+            if self._max[0] is entry:
+                self._max.popleft()
+        if evicted:
+            self._evicted += evicted
+            if self._evicted >= len(items):
+                self._sum = math.fsum(value for _, value in items)
+                self._compensation = 0.0
+                self._evicted = 0
+
+    def result(self, start, end):
+        count = len(self.items)
+        return {"start": start, "end": end, "count": count, "sum": self.sum,
+                "mean": self.sum / count if count else 0.0,
+                "min": self._min[0][1] if count else math.inf,
+                "max": self._max[0][1] if count else -math.inf}
+
+
+class _WindowOperator:
+    """窗口算子基类：用水位线（watermark）处理乱序和迟到数据
+
+    水位线 = 已见最大时间戳 - allowed_lateness。记录先进入按时间戳排序的小顶堆，
+    时间戳不超过水位线后才按顺序交给窗口；早于水位线才到达的记录视为迟到，
+    计入 late_records 并丢弃。
+    """
+
+    def __init__(self, allowed_lateness=0.0, time_key="timestamp", value_key="value"):
+        self.allowed_lateness = allowed_lateness
+        self.time_key = time_key
+        self.value_key = value_key
+        self.watermark = -math.inf
+        self.late_records = 0
+        self._buffer = []
+        self._seq = 0
+
+    def add(self, record):
+        """加入一条记录，返回因此关闭（或更新）的窗口结果列表"""
+        timestamp = record[self.time_key]
+        if timestamp < self.watermark:
+            self.late_records += 1
+            return []
+        heapq.heappush(self._buffer, (timestamp, self._seq, record[self.value_key]))
+        self._seq += 1
+        self.watermark = max(self.watermark, timestamp - self.allowed_lateness)
+        return self._release(self.watermark)
+
+    def _release(self, watermark):
+        results = []
+        buffer = self._buffer
+        while buffer and buffer[0][0] <= watermark:
+            timestamp, _, value = heapq.heappop(buffer)
+            results.extend(self._on_record(timestamp, value))
+        results.extend(self._on_watermark(watermark))
+        return results
+
+    def flush(self):
+        """输入结束：释放缓冲区并关闭所有窗口"""
+        return self._release(math.inf)
+
+    def process(self, records):
+        """同步版本：消费记录生成器，产出窗口结果"""
+        for record in records:
+            yield from self.add(record)
+        yield from self.flush()
+
+    async def aprocess(self, records):
+        """异步版本：消费异步生成器（如 data_stream()），产出窗口结果"""
+        async for record in records:
+            for result in self.add(record):
+                yield result
+        for result in self.flush():
+            yield result
+
+    def _on_record(self, timestamp, value):
+        raise NotImplementedError
+
+    def _on_watermark(self, watermark):
+        return []
+
+
+class TumblingWindow(_WindowOperator):
+    """滚动窗口：[k*size, (k+1)*size) 互不重叠"""
+
+    def __init__(self, size, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self._start = None
+        self._stats = WindowStats()
+
+    def _on_record(self, timestamp, value):
+        start = timestamp - timestamp % self.size
+        results = []
+        if self._start is not None and start != self._start:
+            results.append(self._stats.result(self._start, self._start + self.size))
+            self._stats = WindowStats()
+        self._start = start
+        self._stats.add(value)
+        return results
+
+    def _on_watermark(self, watermark):
+        if self._start is not None and self._start + self.size <= watermark:
+            result = self._stats.result(self._start, self._start + self.size)
+            self._start, self._stats = None, WindowStats()
+            return [result]
+        return []
+
+
+class SlidingWindow(_WindowOperator):
+    """滑动窗口：每条记录到达时输出 (t - size, t] 内的统计"""
+
+    def __init__(self, size, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self._agg = MonotonicAggregate()
+
+    def _on_record(self, timestamp, value):
+        self._agg.push(timestamp, value)
+        self._agg.evict_until(timestamp - self.size)
+        return [self._agg.result(timestamp - self.size, timestamp)]
+
+
+class SessionWindow(_WindowOperator):
+    """会话窗口：相邻记录间隔超过 gap 时切分会话"""
+
+    def __init__(self, gap, **kwargs):
+        super().__init__(**kwargs)
+        self.gap = gap
+        self._start = self._last = None
+        self._stats = WindowStats()
+
+    def _close(self):
+        result = self._stats.result(self._start, self._last)
+        self._start = self._last = None
+        self._stats = WindowStats()
+        return result
+
+    def _on_record(self, timestamp, value):
+        results = []
+        if self._last is not None and timestamp - self._last > self.gap:
+            results.append(self._close())
+        if self._start is None:
+            self._start = timestamp
+        self._last = timestamp
+        self._stats.add(value)
+        return results
+
+    def _on_watermark(self, watermark):
+        if self._last is not None and self._last + self.gap < watermark:
+            return [self._close()]
+        return []
+
+
+def benchmark_windows(n=50_000, size=100):
+    """滑动窗口：单调队列增量统计 vs 每条记录对窗口重新计算"""
+    records = [{"timestamp": float(i), "value": random.random() * 100} for i in range(n)]
+
+    def recompute():
+        window = deque()
+        for r in records:
+            window.append(r)
+            while window[0]["timestamp"] <= r["timestamp"] - size:
+                window.popleft()
+            values = [w["value"] for w in window]
+            _ = (len(values), sum(values), min(values), max(values))
+
+    cases = {
+        "每次重新计算": recompute,
+        "增量 SlidingWindow": lambda: sum(1 for _ in SlidingWindow(size).process(records)),
+    }
+    for label, fn in cases.items():
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f"  {label}: {n} 条记录, 窗口 {size}, {elapsed:.3f}s")
+
+
+async def window_demo():
+    # 乱序与迟到：时间戳 3.5 在 allowed_lateness 内被重新排序，0.5 已低于水位线被丢弃
+    records = [{"timestamp": t, "value": v} for t, v in
+               [(0.1, 5), (1.2, 7), (2.5, 1), (4.0, 9), (3.5, 4), (6.1, 3), (0.5, 100), (9.0, 2)]]
+    tumbling = TumblingWindow(2.0, allowed_lateness=1.0)
+    for result in tumbling.process(records):
+        print(f"  滚动窗口 [{result['start']}, {result['end']}): count={result['count']}, "
+              f"mean={result['mean']:.2f}, min={result['min']}, max={result['max']}")
+    print(f"  迟到丢弃: {tumbling.late_records}")
+    sessions = [f"[{r['start']}, {r['end']}] count={r['count']}"
+                for r in SessionWindow(1.5, allowed_lateness=1.0).process(records)]
+    print(f"  会话窗口: {sessions}")
+
+    sliding = SlidingWindow(0.001)
+    latest = None
+    async for result in sliding.aprocess(data_stream(limit=500)):
+        latest = result
+    print(f"  data_stream 最近 1ms 的滑动统计: count={latest['count']}, "
+          f"mean={latest['mean']:.2f}, max={latest['max']:.2f}")
+
+    # 大值进出窗口后，剩下的小值之和仍然准确；普通的累加累减在这里会得到 0.0
+    drifting = SlidingWindow(100)
+    stream = [{"timestamp": 0.0, "value": 1e16}] + [{"timestamp": float(t), "value": 0.1} for t in range(1, 301)]
+    last = list(drifting.process(stream))[-1]
+    expected = math.fsum([0.1] * last["count"])
+    assert abs(last["sum"] - expected) < 1e-9, last["sum"]
+    print(f"  滑动窗口补偿求和: 最后一个窗口 sum={last['sum']!r}, math.fsum={expected!r}")
+    benchmark_windows()
+
+
+class KLLSketch:
+    """KLL 分位数草图：常数内存、可合并
+
+    第 h 层的每个元素代表 2**h 个原始值。某层装满时排序，随机保留奇数位或偶数位的一半
+    升到上一层。k 越大越精确，归一化秩误差大约为 O(1/k)（k=200 时约 1%）。
+    """
+
+    def __init__(self, k=200, c=2 / 3, seed=None):
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.compactors = [[]]
+        self._size = 0
+        self._max_size = 0
+        self._rng = random.Random(seed)
+        self._update_max_size()
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, math.ceil(self.k * self.c ** depth))
+
+    def _update_max_size(self):
+        self._max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def consume(self, values):
+        """直接消费一个（同步）生成器"""
+        update = self.update
+        for value in values:
+            update(value)
+        return self
+
+    def _compress(self):
+        for h, items in enumerate(self.compactors):
+            if len(items) >= self._capacity(h):
+                if h + 1 == len(self.compactors):
+                    self.compactors.append([])
+                    self._update_max_size()
+                items.sort()
+                # 奇数个元素时保留最后一个在本层
+                keep = [items.pop()] if len(items) % 2 else []
+                promoted = items[self._rng.getrandbits(1)::2]
+                self.compactors[h + 1].extend(promoted)
+                self.compactors[h] = keep
+                self._size = sum(len(c) for c in self.compactors)
+                if self._size < self._max_size:
+                    break
+
+    def merge(self, other):
+        """合并另一个草图（例如在其他进程中构建的）"""
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for h, items in enumerate(other.compactors):
+            self.compactors[h].extend(items)
+        self.n += other.n
+        self._update_max_size()
+        self._size = sum(len(c) for c in self.compactors)
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def _weighted(self):
+        pairs = sorted((v, 1 << h) for h, items in enumerate(self.compactors) for v in items)
+        return pairs
+
+    def quantiles(self, *qs):
+        """一次排序返回多个分位数，qs 取值 0~1"""
+        pairs = self._weighted()
+        total = sum(w for _, w in pairs)
+        results = []
+        for q in qs:
+            target = q * total
+            seen = 0
+            for value, weight in pairs:
+                seen += weight
+                if seen >= target:
+                    results.append(value)
+                    break
+            else:
+                results.append(pairs[-1][0] if pairs else None)
+        return results
+
+    def quantile(self, q):
+        return self.quantiles(q)[0]
+
+    def rank(self, value):
+        """小于等于 value 的比例估计"""
+        total = below = 0
+        for h, items in enumerate(self.compactors):
+            weight = 1 << h
+            total += weight * len(items)
+            below += weight * sum(1 for v in items if v <= value)
+        return below / total if total else 0.0
+
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_PACK_DOUBLE = struct.Struct("<d").pack
+
+
+def _splitmix64(x):
+    """splitmix64 的输出函数：64 位上的双射，相邻输入也会被充分打散"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def _hash64(value):
+    """跨进程稳定的 64 位哈希
+
+    不用内置 hash()：hash(-1) == hash(-2)，模 2**61-1 同余的整数哈希也相同。
+    64 位范围内的整数（以及值为整数的浮点数，保持 1 == 1.0）按补码直接做 splitmix64，
+    这是双射，互不碰撞；其余浮点数打散 IEEE 754 位模式；更大的整数、bytes 和
+    其他对象用 blake2b 哈希带类型前缀的规范字节编码。
+    """
+    if isinstance(value, float):
+        if not value.is_integer():
+            return _splitmix64(int.from_bytes(_PACK_DOUBLE(value), "little"))
+        value = int(value)
+    if isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            return _splitmix64(value & _MASK64)
+        data = b"i" + value.to_bytes(value.bit_length() // 8 + 1, "little", signed=True)
+    elif isinstance(value, bytes):
+        data = b"b" + value
+    else:
+        data = b"r" + repr(value).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计：2**p 个寄存器（p=14 时 16KB），标准误差约 1.04/sqrt(2**p)"""
+
+    def __init__(self, p=14):
+        if not 4 <= p <= 18:
+            raise ValueError(f"p 必须在 4~18 之间: {p}")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def update(self, value):
+        x = _hash64(value)
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def consume(self, values):
+        """直接消费一个（同步）生成器"""
+        update = self.update
+        for value in values:
+            update(value)
+        return self
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("只能合并相同精度的 HyperLogLog")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # 小基数时用线性计数修正
+        return estimate
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+
+def _sketch_partition(args):
+    """子进程中为一段数据构建草图（需是模块顶层函数才能被 pickle）"""
+    seed, count = args
+    rng = random.Random(seed)
+    values = [rng.random() * 100 for _ in range(count)]
+    # 整数 ID 流：相邻分区的区间重叠一半，合并后约 (分区数 + 1) / 2 * count 个不同值
+    first_id = seed * count // 2
+    return (KLLSketch(seed=seed).consume(values),
+            HyperLogLog().consume(round(v, 2) for v in values),
+            HyperLogLog().consume(range(first_id, first_id + count)))
+
+
+def verify_sketches(n=200_000, partitions=4):
+    """在大规模生成数据上检查草图误差，并演示跨进程合并
+
+    误差上界：KLL(k=200) 归一化秩误差 <= 2%；HLL(p=14) 相对误差 <= 3 倍标准误差（约 2.4%）。
+    HLL 分别检查约 1 万个不同值（线性计数修正区间）和数十万个整数 ID（原始估计区间）。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    per_part = n // partitions
+    with ProcessPoolExecutor() as pool:
+        parts = list(pool.map(_sketch_partition, [(seed, per_part) for seed in range(partitions)]))
+    kll, hll, id_hll = parts[0]
+    for other_kll, other_hll, other_id_hll in parts[1:]:
+        kll.merge(other_kll)
+        hll.merge(other_hll)
+        id_hll.merge(other_id_hll)
+
+    exact = []
+    for seed in range(partitions):
+        rng = random.Random(seed)
+        exact.extend(rng.random() * 100 for _ in range(per_part))
+    exact.sort()
+    distinct = len({round(v, 2) for v in exact})
+    distinct_ids = per_part // 2 * (partitions + 1)
+
+    kll_bound = 0.02
+    for q, estimate in zip((0.5, 0.95, 0.99), kll.quantiles(0.5, 0.95, 0.99)):
+        true_rank = bisect_right(exact, estimate) / len(exact)
+        error = abs(true_rank - q)
+        print(f"  p{round(q * 100)}: 估计 {estimate:.3f}, 精确 {exact[int(q * len(exact)) - 1]:.3f}, "
+              f"秩误差 {error:.4f} (上界 {kll_bound})")
+        assert error <= kll_bound
+    hll_bound = 3 * hll.standard_error
+    for label, sketch, truth in (("去重计数", hll, distinct), ("整数 ID 去重", id_hll, distinct_ids)):
+        relative = abs(sketch.count() - truth) / truth
+        print(f"  {label}: 估计 {sketch.count():.0f}, 精确 {truth}, "
+              f"相对误差 {relative:.4f} (上界 {hll_bound:.4f})")
+        assert relative <= hll_bound
+    # 内置 hash() 会让这些值两两相撞；_hash64 必须把它们当作不同的元素
+    colliding = [-1, -2, 5, 5 + (2 ** 61 - 1), 2 ** 70, 2 ** 70 + (2 ** 61 - 1)]
+    assert hash(-1) == hash(-2) and hash(5) == hash(5 + (2 ** 61 - 1))
+    assert len({_hash64(v) for v in colliding}) == len(colliding)
+    assert round(HyperLogLog().consume(colliding).count()) == len(colliding)
+    print(f"  hash() 相撞的 {colliding[:4]} 等值计为 {len(colliding)} 个不同元素")
+    kept = sum(len(c) for c in kll.compactors)
+    print(f"  KLL 保存 {kept} 个元素 / {kll.n} 条数据, HLL {hll.m} 字节寄存器")
+
+
+async def sketch_demo():
+    kll, hll = KLLSketch(), HyperLogLog()
+    async for record in data_stream(limit=5000):
+        kll.update(record["value"])
+        hll.update(round(record["value"], 1))
+    p50, p95, p99 = kll.quantiles(0.5, 0.95, 0.99)
+    print(f"  data_stream: p50={p50:.2f}, p95={p95:.2f}, p99={p99:.2f}, "
+          f"不同值(保留 1 位小数)≈{hll.count():.0f}")
+    verify_sketches()
+
+
+class SharedRingBuffer:
+    """基于 multiprocessing.shared_memory 的单生产者/单消费者环形缓冲区
+
+    每条记录固定为 (timestamp, value) 两个 double，共 16 字节。
+    头部只有三个 8 字节计数器：head（已写入总数，只由生产者修改）、
+    tail（已读取总数，只由消费者修改）和 closed 标志，各自占一个缓存行。
+    生产者先写数据再发布 head，消费者读完数据再推进 tail。
+
+    无锁只在 LOCK_FREE 为真时成立：CPython + x86/x86-64。那里 8 字节对齐的写入
+    是原子的，TSO 内存模型也保证“先写数据、后写 head”不会被重排。ARM 等弱序
+    CPU 上没有这个保证，消费者可能先看到新的 head 再看到旧的数据，
+    所以计数器的读写改为在一把 multiprocessing.Lock 内进行（锁的获取/释放带内存屏障）。
+
+    对象可以直接作为参数传给子进程，子进程会按名字重新连接同一块共享内存。
+    """
+
+    RECORD = struct.Struct("dd")
+    _HEAD, _TAIL, _CLOSED = 0, 8, 16  # 以 8 字节为单位的下标，彼此间隔 64 字节
+    _HEADER = 192
+    LOCK_FREE = (platform.python_implementation() == "CPython"
+                 and platform.machine().lower() in {"x86_64", "amd64", "i386", "i686", "x86"})
+
+    def __init__(self, capacity=1 << 16, name=None, lock=None):
+        from multiprocessing import shared_memory
+
+        self.capacity = capacity
+        self._owner = name is None
+        if lock is None and self._owner and not self.LOCK_FREE:
+            import multiprocessing
+            lock = multiprocessing.Lock()
+        self._lock = lock
+        size = self._HEADER + capacity * self.RECORD.size
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self.name = self._shm.name
+        buf = self._shm.buf
+        self._counters = buf[:self._HEADER].cast("q")
+        self._data = buf[self._HEADER:size]
+        self._segment = None  # batches() 当前产出、尚未归还的段
+        if self._owner:
+            self._counters[self._HEAD] = self._counters[self._TAIL] = self._counters[self._CLOSED] = 0
+
+    def __reduce__(self):
+        # 锁只能在创建子进程时随参数传递，正好是这个对象的用法
+        return (type(self), (self.capacity, self.name, self._lock))
+
+    def _load(self, index):
+        if self._lock is None:
+            return self._counters[index]
+        with self._lock:
+            return self._counters[index]
+
+    def _store(self, index, value):
+        if self._lock is None:
+            self._counters[index] = value
+        else:
+            with self._lock:
+                self._counters[index] = value
+
+    def __len__(self):
+        return self._load(self._HEAD) - self._load(self._TAIL)
+
+    @staticmethod
+    def _wait(spins):
+        # 先忙等几轮，仍然没有进展再让出 CPU
+        if spins > 100:
+            time.sleep(0.0001)
+        elif spins > 10:
+            time.sleep(0)
+
+    # ---- 生产者端 ----
+    def _publish(self, values):
+        """把一批扁平的 array('d') 写入环中；空间不足时等待消费者"""
+        load, size = self._load, self.RECORD.size
+        raw = memoryview(values).cast("B")
+        written, total = 0, len(values) // 2
+        spins = 0
+        while written < total:
+            head = load(self._HEAD)
+            free = self.capacity - (head - load(self._TAIL))
+            if not free:
+                spins += 1
+                self._wait(spins)
+                continue
+            spins = 0
+            slot = head % self.capacity
+            n = min(free, total - written, self.capacity - slot)  # 不跨越环尾
+            self._data[slot * size:(slot + n) * size] = raw[written * size:(written + n) * size]
+            written += n
+            self._store(self._HEAD, head + n)  # 数据写完后才发布
+
+    def write_from(self, records, batch=1024):
+        """消费一个产出 (timestamp, value) 的生成器，每 batch 条发布一次"""
+        pending = array("d")
+        extend = pending.extend
+        for record in records:
+            extend(record)
+            if len(pending) >= 2 * batch:
+                self._publish(pending)
+                pending = array("d")
+                extend = pending.extend
+        if pending:
+            self._publish(pending)
+
+    async def awrite_from(self, records, batch=1024):
+        """write_from 的异步版本：直接消费 data_stream() 这类异步生成器产出的字典"""
+        pending = array("d")
+        batch = min(batch, self.capacity)
+        async for record in records:
+            pending.append(record["timestamp"])
+            pending.append(record["value"])
+            if len(pending) >= 2 * batch:
+                while self.capacity - len(self) < batch:
+                    await asyncio.sleep(0.0001)  # 环满时不阻塞事件循环
+                self._publish(pending)
+                pending = array("d")
+        if pending:
+            self._publish(pending)
+
+    def close(self):
+        """生产者写完后调用，消费者读空后结束迭代"""
+        self._store(self._CLOSED, 1)
+
+    # ---- 消费者端 ----
+    def batches(self):
+        """产出指向共享内存的 memoryview（零拷贝），每段是若干条连续记录的原始字节
+
+        消费者处理完一段、向生成器要下一段时，该段会被 release() 并推进 tail，
+        所以产出的 memoryview 只在下一次迭代之前有效；需要保留时先 bytes(segment)。
+        """
+        load, size = self._load, self.RECORD.size
+        spins = 0
+        try:
+            while True:
+                tail = load(self._TAIL)
+                available = load(self._HEAD) - tail
+                if not available:
+                    if load(self._CLOSED) and load(self._HEAD) == tail:
+                        return
+                    spins += 1
+                    self._wait(spins)
+                    continue
+                spins = 0
+                slot = tail % self.capacity
+                n = min(available, self.capacity - slot)
+                self._segment = segment = self._data[slot * size:(slot + n) * size]
+                yield segment
+                segment.release()  # 先归还导出的视图，共享内存才能在 release() 中关闭
+                self._segment = None
+                self._store(self._TAIL, tail + n)
+        finally:
+            if self._segment is not None:
+                self._segment.release()
+                self._segment = None
+
+    def records(self):
+        """逐条产出 (timestamp, value) 元组"""
+        iter_unpack = self.RECORD.iter_unpack
+        for segment in self.batches():
+            yield from iter_unpack(segment)
+
+    def release(self):
+        """释放本进程对共享内存的引用；创建者还会删除共享内存
+
+        未迭代完的 batches() 产出的段会先被释放；调用方自己从段上派生
+        并仍然持有的视图（如 segment.cast("d")）必须先释放，否则抛出 BufferError。
+        """
+        if self._segment is not None:
+            self._segment.release()
+            self._segment = None
+        self._counters.release()
+        self._data.release()
+        if self._owner:
+            self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            raise BufferError("仍有从环形缓冲区导出的 memoryview 未释放") from None
+
+
+def _ring_producer(ring, count):
+    ring.write_from((float(i), i * 0.5) for i in range(count))
+    ring.close()
+
+
+def _ring_stream_producer(ring, count):
+    asyncio.run(ring.awrite_from(data_stream(limit=count), batch=256))
+    ring.close()
+
+
+def _queue_producer(queue, count, batch):
+    if batch:
+        for start in range(0, count, batch):
+            queue.put([{"timestamp": float(i), "value": i * 0.5} for i in range(start, min(count, start + batch))])
+    else:
+        for i in range(count):
+            queue.put({"timestamp": float(i), "value": i * 0.5})
+    queue.put(None)
+
+
+def benchmark_transports(count=200_000):
+    """同样的记录分别经 multiprocessing.Queue 和共享内存环形缓冲区跨进程传递"""
+    import multiprocessing as mp
+
+    def run(label, target, args, consume):
+        start = time.perf_counter()
+        process = mp.Process(target=target, args=args)
+        process.start()
+        total = consume()
+        process.join()
+        elapsed = time.perf_counter() - start
+        assert total == sum(i * 0.5 for i in range(count))
+        print(f"  {label}: {count / elapsed / 1e6:.2f}M 条/s")
+
+    def consume_queue(queue, batched):
+        total = 0.0
+        while (item := queue.get()) is not None:
+            if batched:
+                for record in item:
+                    total += record["value"]
+            else:
+                total += item["value"]
+        return total
+
+    queue = mp.Queue()
+    run("Queue 逐条传字典", _queue_producer, (queue, count, 0), lambda: consume_queue(queue, False))
+    run("Queue 每 1000 条一批", _queue_producer, (queue, count, 1000), lambda: consume_queue(queue, True))
+
+    ring = SharedRingBuffer(1 << 16)
+    try:
+        run("环形缓冲区 records()", _ring_producer, (ring, count),
+            lambda: sum(value for _, value in ring.records()))
+    finally:
+        ring.release()
+
+    ring = SharedRingBuffer(1 << 16)
+    try:
+        def consume_batches():
+            # 零拷贝：直接把共享内存按 double 解释，只取 value 列求和
+            total = 0.0
+            for segment in ring.batches():
+                total += sum(segment.cast("d")[1::2])
+            return total
+
+        run("环形缓冲区 batches() 零拷贝", _ring_producer, (ring, count), consume_batches)
+    finally:
+        ring.release()
+
+
+def ring_demo():
+    import multiprocessing as mp
+
+    ring = SharedRingBuffer(capacity=1024)
+    try:
+        producer = mp.Process(target=_ring_stream_producer, args=(ring, 5000))
+        producer.start()
+        count, total, last = 0, 0.0, 0.0
+        for timestamp, value in ring.records():
+            assert timestamp >= last
+            count, total, last = count + 1, total + value, timestamp
+        producer.join()
+        print(f"  子进程的 data_stream 经共享内存送达 {count} 条, 均值 {total / count:.2f}")
+    finally:
+        ring.release()
+
+    # 弱序 CPU 上自动启用的加锁模式，这里显式传入锁来演示
+    ring = SharedRingBuffer(capacity=256, lock=mp.Lock())
+    try:
+        producer = mp.Process(target=_ring_producer, args=(ring, 20_000))
+        producer.start()
+        total = sum(value for _, value in ring.records())
+        producer.join()
+        assert total == sum(i * 0.5 for i in range(20_000))
+        print(f"  加锁模式送达 20000 条 (本机 LOCK_FREE={SharedRingBuffer.LOCK_FREE})")
+    finally:
+        ring.release()
+
+    # 消费者中途退出、手里还有未归还的段时，release() 也能关闭共享内存
+    ring = SharedRingBuffer(capacity=64)
+    ring.write_from((float(i), 0.0) for i in range(10))
+    segments = ring.batches()
+    first = next(segments)
+    ring.release()
+    try:
+        first.nbytes
+        state = "仍可用"
+    except ValueError:  # 已释放的 memoryview 不允许任何操作
+        state = "已释放"
+    print(f"  消费者中途退出后 release(): 未归还的段{state}，共享内存已关闭")
+    benchmark_transports()
+
+
+# 草图和环形缓冲区的演示会用到多进程，子进程会重新导入本模块，演示代码放在 __main__ 保护下
+if __name__ == "__main__":
+    print("------------异步数据流与背压------------")
+    asyncio.run(demo())
+    print("\n------------时间窗口聚合------------")
+    asyncio.run(window_demo())
+    print("\n------------分位数与去重计数草图------------")
+    asyncio.run(sketch_demo())
+    print("\n------------共享内存环形缓冲区------------")
+    ring_demo()
@@ -1,11 +1,93 @@
 import time
-
-
-def fibonacci():
-    a, b = 0, 1
-    while True:
-        yield a
-        a, b = b, a + b
+from bisect import bisect_right, insort
+from itertools import islice
+
+
+class FibonacciEngine:
+    """斐波那契引擎
+
+    - 单项：快速倍增（fast doubling），O(log n) 次大整数乘法，无递归
+    - 复用：记住算过的 (F(k), F(k+1)) 检查点，目标离检查点不远时直接向前迭代
+    - 区间/批量：只定位一次起点，之后逐项相加
+    """
+
+    WALK_LIMIT = 64  # 离最近检查点不超过这么多项时，向前迭代比倍增更便宜
+    MAX_CHECKPOINTS = 256
+
+    def __init__(self):
+        self._indices = [0]
+        self._pairs = {0: (0, 1)}
+
+    @staticmethod
+    def fast_doubling(n):
+        """返回 (F(n), F(n+1))，迭代实现"""
+        a, b = 0, 1
+        for bit in bin(n)[2:]:
+            # F(2k) = F(k) * (2F(k+1) - F(k)), F(2k+1) = F(k)^2 + F(k+1)^2
+            c = a * (2 * b - a)
+            d = a * a + b * b
+            a, b = (d, c + d) if bit == "1" else (c, d)
+        return a, b
+
+    def pair(self, n):
+        """返回 (F(n), F(n+1))，优先从检查点向前迭代"""
+        if n < 0:
+            raise ValueError(f"n 必须为非负整数: {n}")
+        cached = self._pairs.get(n)
+        if cached is not None:
+            return cached
+        k = self._indices[bisect_right(self._indices, n) - 1]
+        if n - k <= self.WALK_LIMIT:
+            a, b = self._pairs[k]
+            for _ in range(n - k):
+                a, b = b, a + b
+        else:
+            a, b = self.fast_doubling(n)
+        self._remember(n, (a, b))
+        return a, b
+
+    def _remember(self, n, pair):
+        if len(self._indices) < self.MAX_CHECKPOINTS:
+            insort(self._indices, n)
+            self._pairs[n] = pair
+
+    def get(self, n):
+        """F(n)"""
+        return self.pair(n)[0]
+
+    def range(self, start, stop):
+        """[F(start), ..., F(stop-1)]，只定位一次起点"""
+        return list(islice(self.stream(start), max(0, stop - start)))
+
+    def batch(self, ns):
+        """批量查询，按升序处理，相邻下标之间复用前一个结果"""
+        ns = list(ns)
+        results = {}
+        prev_n, a, b = None, 0, 1
+        for n in sorted(set(ns)):
+            if prev_n is not None and n - prev_n <= self.WALK_LIMIT:
+                for _ in range(n - prev_n):
+                    a, b = b, a + b
+            else:
+                a, b = self.pair(n)
+            results[n] = a
+            prev_n = n
+        return [results[n] for n in ns]
+
+    def stream(self, start=0):
+        """从任意下标开始的无限斐波那契生成器"""
+        a, b = self.pair(start)
+        while True:
+            yield a
+            a, b = b, a + b
+
+
+fib_engine = FibonacciEngine()
+
+
+def fibonacci(start=0):
+    """斐波那契生成器，可以从第 start 项开始"""
+    yield from fib_engine.stream(start)
 
 # 好处：
 # 1. 惰性计算：按需生成值，节省内存
@@ -23,6 +105,53 @@ print(next(fib))  # 1
 print(next(fib))  # 1
 print(next(fib))  # 2
 
+# 从任意下标开始、区间和批量查询
+print(f"F(100) 起的 3 项: {list(islice(fibonacci(100), 3))}")
+print(f"F(10..15): {fib_engine.range(10, 15)}")
+print(f"批量查询: {fib_engine.batch([30, 10, 20])}")
+
+
+def benchmark_fibonacci(sizes=(10, 100, 1_000, 10_000, 100_000, 1_000_000)):
+    """对比快速倍增引擎、原先的逐项生成器和 3.4 中的递归缓存版本"""
+    import sys
+
+    def linear_generator():
+        a, b = 0, 1
+        while True:
+            yield a
+            a, b = b, a + b
+
+    def recursive_cached(n, cache):
+        # 3.4 中 cache_decorator + 递归的写法；每次计时传入新的空缓存，避免后面的规模命中前面的结果
+        key = str((n,)) + str([])
+        if key not in cache:
+            cache[key] = n if n <= 1 else recursive_cached(n - 1, cache) + recursive_cached(n - 2, cache)
+        return cache[key]
+
+    def timed(fn):
+        start = time.perf_counter()
+        value = fn()
+        return value, time.perf_counter() - start
+
+    for n in sizes:
+        value, fast = timed(lambda: FibonacciEngine.fast_doubling(n)[0])
+        row = [f"快速倍增 {fast * 1e3:.3f}ms"]
+        if n <= 100_000:
+            linear, elapsed = timed(lambda: next(islice(linear_generator(), n, None)))
+            assert linear == value
+            row.append(f"逐项生成器 {elapsed * 1e3:.3f}ms")
+        else:
+            row.append("逐项生成器 跳过(太慢)")
+        if n * 2 < sys.getrecursionlimit() - 100:
+            recursive, elapsed = timed(lambda: recursive_cached(n, {}))
+            assert recursive == value
+            row.append(f"递归缓存 {elapsed * 1e3:.3f}ms")
+        else:
+            row.append("递归缓存 超出递归深度")
+        print(f"  n={n:>9}: " + ", ".join(row))
+
+benchmark_fibonacci()
+
 
 # 生成器表达式示例
 squares = (x**2 for x in range(10))
@@ -31,7 +160,7 @@ for i, num in zip(range(5), squares):
     print(f"Square {i}: {num}")
 
 
-# 文件读取生成器
+# 文件读取生成器（基于 mmap 的二进制/随机访问版本见 2.1.大文件读取.py）
 def read_large_file(file_path):
     """逐行读取大文件"""
     with open(file_path, "r", encoding="utf-8") as f:
@@ -61,20 +61,64 @@ print(f"父类调用类方法: {Parent.class_method()}")
 
 print("\n------------描述符协议------------")
 
+import types
 import weakref
 from typing import Any, Union
 
 class PositiveNumber:
-    """描述符：确保数值为正数"""
+    """描述符：确保数值为正数
+
+    __set_name__ 时记下属性名，值直接存放在实例 __dict__ 的同名条目中
+    （数据描述符优先于实例字典，所以读写仍会经过描述符）；
+    类声明了 `_<属性名>` 槽位时则存放在槽位里。值随实例一起回收，无需弱引用字典。
+    """
     
     def __init__(self, default: Union[int, float] = 0):
         self.default = default
-        self._value = weakref.WeakKeyDictionary()  # 使用弱引用避免内存泄漏
+        self.name = None
+        self._slot = None
+    
+    def __set_name__(self, owner: Any, name: str) -> None:
+        self.name = name
+        slot = getattr(owner, f"_{name}", None)
+        if isinstance(slot, types.MemberDescriptorType):
+            self._slot = slot
     
     def __get__(self, instance: Any, owner: Any) -> Union[int, float]:
         if instance is None:
             return 0
         # 返回实际数值而不是描述符本身，避免类型检查错误
+        if self._slot is None:
+            return instance.__dict__.get(self.name, self.default)
+        try:
+            return self._slot.__get__(instance, owner)
+        except AttributeError:
+            return self.default
+    
+    def __set__(self, instance: Any, value: Union[int, float]) -> None:
+        if value < 0:
+            raise ValueError("数值必须为正数")
+        if self._slot is None:
+            instance.__dict__[self.name] = value
+        else:
+            self._slot.__set__(instance, value)
+    
+    def __delete__(self, instance: Any) -> None:
+        if self._slot is None:
+            instance.__dict__.pop(self.name, None)
+        elif hasattr(instance, self._slot.__name__):
+            self._slot.__delete__(instance)
+
+class WeakKeyPositiveNumber:
+    """旧版描述符：值存在 WeakKeyDictionary 中，每次读写都要查一次弱引用字典，仅用于对比"""
+    
+    def __init__(self, default: Union[int, float] = 0):
+        self.default = default
+        self._value = weakref.WeakKeyDictionary()
+    
+    def __get__(self, instance: Any, owner: Any) -> Union[int, float]:
+        if instance is None:
+            return 0
         return self._value.get(instance, self.default)
     
     def __set__(self, instance: Any, value: Union[int, float]) -> None:
@@ -108,6 +152,30 @@ except ValueError as e:
     print(f"错误: {e}")
 
 
+def benchmark_positive_number(n=20_000, repeat=5):
+    """对比 WeakKeyDictionary 存储与实例 __dict__ 存储的读写吞吐和内存"""
+    import timeit
+    import tracemalloc
+
+    class LegacyProduct(Product):
+        price = WeakKeyPositiveNumber(0)
+        quantity = WeakKeyPositiveNumber(1)
+
+    for cls in (LegacyProduct, Product):
+        item = cls("苹果", 10, 5)
+        get_time = min(timeit.repeat(lambda: item.price, number=n, repeat=repeat)) / n
+        set_time = min(timeit.repeat(lambda: setattr(item, "price", 12), number=n, repeat=repeat)) / n
+        tracemalloc.start()
+        items = [cls("苹果", 10, 5) for _ in range(n)]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del items
+        print(f"  {cls.__name__:>13}: get {get_time * 1e9:.0f}ns, set {set_time * 1e9:.0f}ns, "
+              f"{memory / n:.0f} 字节/实例")
+
+benchmark_positive_number()
+
+
 print("\n------------运算符重载------------")
 
 class Vector2D:
@@ -255,8 +323,21 @@ print(f"db1 id: {id(db1)}, db2 id: {id(db2)}")
 
 print("\n------------动态类创建------------")
 
-def create_class(name, bases, attrs):
-    """动态创建类的工厂函数"""
+from collections import OrderedDict
+
+# 与 3.4 共用的记录类模板（__slots__/__init__/__repr__/__eq__），见同目录 _record_codegen.py
+from _record_codegen import build_record_methods, check_field_names
+
+_CLASS_CACHE_SIZE = 128
+_class_cache = OrderedDict()  # LRU，避免属性里的内联函数让缓存无限增长
+
+def create_class(name, bases, attrs, fields=None):
+    """动态创建类的工厂函数
+    
+    传入 fields（字段名序列）时生成带显式参数的 __init__、__slots__、
+    __repr__ 和 __eq__，并按 (类名, 基类, 字段, 属性) 缓存生成的类
+    （最多 _CLASS_CACHE_SIZE 个，按最近使用淘汰）。
+    """
     
     # 验证类名
     if not isinstance(name, str) or not name.isidentifier():
@@ -267,6 +348,20 @@ def create_class(name, bases, attrs):
         if not isinstance(base, type):
             raise TypeError(f"基类必须是类型对象: {base}")
     
+    if fields is not None:
+        fields = check_field_names(fields)
+        for key in fields:
+            if key.startswith('_'):
+                raise ValueError(f"不能设置私有属性: {key}")
+        try:
+            cache_key = (name, tuple(bases), fields, tuple(sorted(attrs.items())))
+            cached = _class_cache.get(cache_key)
+        except TypeError:  # 属性值不可哈希时不缓存
+            cache_key = cached = None
+        if cached is not None:
+            _class_cache.move_to_end(cache_key)
+            return cached
+    
     def __init__(self, **kwargs):
         # 验证属性名
         for key, value in kwargs.items():
@@ -275,9 +370,17 @@ def create_class(name, bases, attrs):
             setattr(self, key, value)
     
     def __str__(self):
-        attrs = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+        if fields is not None:
+            attrs = {k: getattr(self, k) for k in fields}
+        else:
+            attrs = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
         return f"{self.__class__.__name__}({attrs})"
     
+    attrs = dict(attrs)
+    if fields is not None:
+        for key, value in build_record_methods(name, fields).items():
+            attrs.setdefault(key, value)
+    
     # 避免覆盖现有属性
     if '__init__' not in attrs:
         attrs['__init__'] = __init__
@@ -285,7 +388,12 @@ def create_class(name, bases, attrs):
         attrs['__str__'] = __str__
     attrs['created_dynamically'] = True
     
-    return type(name, bases, attrs)
+    cls = type(name, bases, attrs)
+    if fields is not None and cache_key is not None:
+        _class_cache[cache_key] = cls
+        if len(_class_cache) > _CLASS_CACHE_SIZE:
+            _class_cache.popitem(last=False)
+    return cls
 
 # 动态创建类
 DynamicUser = create_class('DynamicUser', (), {})
@@ -299,6 +407,36 @@ print(f"动态用户: {user}")
 print(f"动态产品: {product}")
 print(f"类是否动态创建: {hasattr(user, 'created_dynamically')}")
 
+# 传入字段模式：生成专用 __init__ 和 __slots__
+FastUser = create_class('FastUser', (), {}, fields=('name', 'age'))
+fast_user = FastUser("李四", 30)
+print(f"生成的类: {fast_user!r}, 相等: {fast_user == FastUser('李四', 30)}, "
+      f"有 __dict__ 吗: {hasattr(fast_user, '__dict__')}")
+for bad in (('__secret',), ('self',), ('name', 'name')):
+    try:
+        create_class('BadRecord', (), {}, fields=bad)
+    except ValueError as e:
+        print(f"拒绝字段 {bad}: {e}")
+print(f"重复创建复用缓存: {create_class('FastUser', (), {}, fields=('name', 'age')) is FastUser}")
+
+
+def benchmark_create_class(n=50_000):
+    """对比通用 **kwargs 类与生成类的实例化速度和单实例内存"""
+    import timeit
+    import tracemalloc
+
+    for label, cls in (("**kwargs", create_class('Record', (), {})),
+                       ("fields", create_class('Record', (), {}, fields=('name', 'price')))):
+        elapsed = min(timeit.repeat(lambda: cls(name="手机", price=2999), number=n, repeat=3)) / n
+        tracemalloc.start()
+        objs = [cls(name="手机", price=2999) for _ in range(n)]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del objs
+        print(f"  {label:>8}: {elapsed * 1e9:.0f}ns/实例, {memory / n:.0f} 字节/实例")
+
+benchmark_create_class()
+
 
 print("\n------------多重继承和 super()------------")
 
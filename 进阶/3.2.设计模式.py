@@ -1,31 +1,455 @@
 print("------------观察者模式------------")
 
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+class CoalescePolicy:
+    """合并策略基类：决定每条读数是立即送达、暂存还是并入下一次送达
+
+    观察者上一次送达还没处理完时，新的送达不会排队，而是覆盖（或合并进）暂存的一份，
+    处理完后只补送这一份——慢观察者拿到的总是最新状态，不会积压。
+    每个观察者需要各自的策略实例。
+    """
+
+    def __init__(self):
+        # offer 在发布者线程、due 在计时线程调用，共用一把可重入锁
+        self._lock = threading.RLock()
+        self._busy = False
+        self._pending = None
+
+    def merge(self, pending, delivery):
+        """观察者忙碌期间两次送达如何合并，默认只保留最新的"""
+        return delivery
+
+    def _admit(self, delivery):
+        with self._lock:
+            if self._busy:
+                self._pending = delivery if self._pending is None else self.merge(self._pending, delivery)
+                return None
+            self._busy = True
+            return delivery
+
+    def done(self):
+        """一次送达处理完毕；返回忙碌期间暂存的送达（没有则为 None）"""
+        with self._lock:
+            delivery, self._pending = self._pending, None
+            self._busy = delivery is not None
+            return delivery
+
+    def offer(self, args, kwargs, now):
+        """收到一条读数，返回要立即送达的 (args, kwargs) 或 None"""
+        return self._admit((args, kwargs))
+
+    def due(self, now):
+        """到期的延迟送达，没有则返回 None"""
+        return None
+
+    def flush(self):
+        """立即取出暂存的读数（不管是否到期），没有则返回 None；关闭时调用"""
+        return None
+
+    @property
+    def idle(self):
+        """没有正在处理或等待补送的送达"""
+        with self._lock:
+            return not self._busy
+
+    def next_deadline(self):
+        """下一次需要检查 due() 的时间（time.monotonic），没有则为 None"""
+        return None
+
+class LatestWins(CoalescePolicy):
+    """最新值优先：空闲时立即送达，忙碌时只保留最新的一条"""
+
+class Throttle(CoalescePolicy):
+    """节流：每 interval 秒最多送达一次；窗口内的最后一条在窗口结束时补送"""
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self._last = float("-inf")
+        self._latest = None
+
+    def offer(self, args, kwargs, now):
+        with self._lock:
+            if now - self._last >= self.interval:
+                self._last, self._latest = now, None
+                return self._admit((args, kwargs))
+            self._latest = (args, kwargs)
+            return None
+
+    def due(self, now):
+        with self._lock:
+            if self._latest is not None and now - self._last >= self.interval:
+                self._last, delivery, self._latest = now, self._latest, None
+                return self._admit(delivery)
+            return None
+
+    def flush(self):
+        with self._lock:
+            delivery, self._latest = self._latest, None
+            return None if delivery is None else self._admit(delivery)
+
+    def next_deadline(self):
+        return self._last + self.interval if self._latest is not None else None
+
+class Debounce(CoalescePolicy):
+    """防抖：读数停止 wait 秒后才送达最后一条"""
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+        self._deadline = None
+        self._latest = None
+
+    def offer(self, args, kwargs, now):
+        with self._lock:
+            self._latest, self._deadline = (args, kwargs), now + self.wait
+            return None
+
+    def due(self, now):
+        with self._lock:
+            if self._deadline is not None and now >= self._deadline:
+                delivery, self._latest, self._deadline = self._latest, None, None
+                return self._admit(delivery)
+            return None
+
+    def flush(self):
+        with self._lock:
+            delivery, self._latest, self._deadline = self._latest, None, None
+            return None if delivery is None else self._admit(delivery)
+
+    def next_deadline(self):
+        return self._deadline
+
+class Batch(CoalescePolicy):
+    """批量：把上次送达以来的读数攒成列表，每 interval 秒或攒满 max_size 条时送达一次
+
+    观察者收到 update(observable, readings)，readings 是各次通知的位置参数元组列表。
+    不满一批的尾部读数在 Observable.flush() / close() 时送出。
+    """
+
+    def __init__(self, interval=None, max_size=None):
+        super().__init__()
+        if interval is None and max_size is None:
+            raise ValueError("interval 和 max_size 至少指定一个")
+        self.interval = interval
+        self.max_size = max_size
+        self._readings = []
+        self._deadline = None
+
+    def merge(self, pending, delivery):
+        # 观察者忙碌期间的多批读数合并成一批，不丢数据也不排队
+        return ((pending[0][0] + delivery[0][0],), {})
+
+    def _flush(self):
+        readings, self._readings, self._deadline = self._readings, [], None
+        return self._admit(((readings,), {}))
+
+    def offer(self, args, kwargs, now):
+        with self._lock:
+            self._readings.append(args)
+            if self._deadline is None and self.interval is not None:
+                self._deadline = now + self.interval
+            if self.max_size is not None and len(self._readings) >= self.max_size:
+                return self._flush()
+            return None
+
+    def due(self, now):
+        with self._lock:
+            if self._readings and self._deadline is not None and now >= self._deadline:
+                return self._flush()
+            return None
+
+    def flush(self):
+        # 只按 max_size 送达时，不满一批的尾部读数靠这里送出
+        with self._lock:
+            return self._flush() if self._readings else None
+
+    def next_deadline(self):
+        return self._deadline if self._readings else None
+
 class Observable:
-    """被观察者类"""
-    
+    """被观察者类
+
+    观察者通过弱引用保存在以 id 为键的字典中：添加、移除都是 O(1)，
+    观察者被回收后自动从注册表中消失。不支持弱引用的观察者（内置类型、
+    没有 __weakref__ 槽位的 __slots__ 类）退回强引用，需要显式 remove_observer。
+
+    dispatch 决定通知方式：
+        "sync": 在发布者线程中依次调用（超时无法中断，只记录超时）
+        "thread": 在线程池中送达，发布者最多等待 timeout 秒，未完成的记为超时。
+            每个观察者有自己的送达队列，同一时刻最多一个任务在处理它，读数按发布顺序送达；
+            队列最多积压 max_pending 条，再多时丢弃最旧的一条并记入 errors
+        "async": 在当前事件循环中为每个观察者创建任务，update 可以是协程
+    任一观察者抛出的异常或超时都只记录在 errors 中，不影响其他观察者。
+
+    add_observer 时可以为观察者指定合并策略（CoalescePolicy）。节流、防抖、批量
+    的延迟送达由一个后台计时线程负责（async 模式下转交回事件循环）。
+    """
+
+    DISPATCH_MODES = ("sync", "thread", "async")
+
+    def __init__(self, dispatch="sync", timeout=None, max_workers=None, max_pending=1000):
+        if dispatch not in self.DISPATCH_MODES:
+            raise ValueError(f"未知的通知方式: {dispatch}")
+        if max_pending < 1:
+            raise ValueError(f"max_pending 必须为正数: {max_pending}")
+        self._observers = {}
+        self._policies = {}
+        self.max_pending = max_pending
+        self._mailboxes = {}  # id(观察者) -> 待送达队列，只在 thread 模式使用
+        self._mail_lock = threading.Lock()
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.errors = deque(maxlen=100)  # 最近的 (观察者, 异常)
+        self._executor = None
+        self._loop = None
+        self._timer = None
+        self._timer_wakeup = threading.Condition()
+        self._closed = False
+
+    def add_observer(self, observer, policy=None):
+        """添加观察者，policy 为该观察者的合并策略"""
+        key = id(observer)
+        if key not in self._observers:
+            observers, policies = self._observers, self._policies
+            # 回调只引用字典，不引用 self，避免观察者反过来让被观察者存活
+            def discard(ref, key=key):
+                if observers.get(key) is ref:
+                    del observers[key]
+                    policies.pop(key, None)
+            try:
+                observers[key] = weakref.ref(observer, discard)
+            except TypeError:
+                # 不支持弱引用时退回强引用，调用方式与弱引用相同
+                observers[key] = lambda observer=observer: observer
+            if policy is not None:
+                policies[key] = policy
+
+    def remove_observer(self, observer):
+        """移除观察者"""
+        self._observers.pop(id(observer), None)
+        self._policies.pop(id(observer), None)
+
+    @property
+    def observers(self):
+        """当前仍存活的观察者"""
+        return [observer for ref in list(self._observers.values()) if (observer := ref()) is not None]
+
+    def _call(self, observer, args, kwargs, check_time=False):
+        try:
+            start = time.perf_counter() if check_time else 0.0
+            observer.update(self, *args, **kwargs)
+            if check_time and time.perf_counter() - start > self.timeout:
+                self.errors.append((observer, TimeoutError("观察者处理超时")))
+        except Exception as exc:
+            self.errors.append((observer, exc))
+
+    async def _call_async(self, observer, args, kwargs):
+        try:
+            result = observer.update(self, *args, **kwargs)
+            if asyncio.iscoroutine(result):
+                await asyncio.wait_for(result, self.timeout)
+        except asyncio.TimeoutError:
+            self.errors.append((observer, TimeoutError("观察者处理超时")))
+        except Exception as exc:
+            self.errors.append((observer, exc))
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="observer")
+        return self._executor
+
+    def _deliver(self, observer, args, kwargs, policy=None):
+        """按 dispatch 方式调用一个观察者；处理完后补送 policy 暂存的最新读数"""
+        if self.dispatch == "sync":
+            self._call(observer, args, kwargs, self.timeout is not None)
+            self._finished(observer, policy)
+            return None
+        if self.dispatch == "thread":
+            future = self._post(observer, args, kwargs)
+        else:
+            future = self._loop.create_task(self._call_async(observer, args, kwargs))
+        if policy is not None:
+            future.add_done_callback(lambda _: self._finished(observer, policy))
+        return future
+
+    def _post(self, observer, args, kwargs):
+        """放入观察者的送达队列；队列空闲时才向线程池提交一个排空任务"""
+        future = Future()
+        key = id(observer)
+        with self._mail_lock:
+            mailbox = self._mailboxes.get(key)
+            if mailbox is None:
+                mailbox = self._mailboxes[key] = deque()
+                start = True
+            else:
+                start = False
+                if len(mailbox) >= self.max_pending:
+                    mailbox.popleft()[3].cancel()
+                    self.errors.append((observer, OverflowError("观察者积压过多，丢弃最旧的通知")))
+            mailbox.append((observer, args, kwargs, future))
+        if start:
+            self._pool().submit(self._drain, key)
+        return future
+
+    def _drain(self, key):
+        """依次处理一个观察者队列中的送达；队列清空后移除队列，下次送达重新提交"""
+        while True:
+            with self._mail_lock:
+                mailbox = self._mailboxes[key]
+                if not mailbox:
+                    del self._mailboxes[key]
+                    return
+                observer, args, kwargs, future = mailbox.popleft()
+            if future.set_running_or_notify_cancel():
+                self._call(observer, args, kwargs)
+                future.set_result(None)
+
+    def _finished(self, observer, policy):
+        if policy is not None and (delivery := policy.done()) is not None:
+            self._deliver(observer, *delivery, policy)
+
+    def notify_observers(self, *args, **kwargs):
+        """通知所有观察者
+
+        async 模式返回一个可 await 的 Future（本次立即送达的观察者都处理完成）；其余模式返回 None。
+        """
+        if self.dispatch == "async":
+            self._loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        policies = self._policies
+        sync, check_time, call = self.dispatch == "sync", self.timeout is not None, self._call
+        futures = {}
+        for key, ref in list(self._observers.items()):
+            observer = ref()
+            if observer is None:
+                continue
+            policy = policies.get(key) if policies else None
+            if policy is None:
+                if sync:  # 最常见的情况直接调用，省掉 _deliver 的分派
+                    call(observer, args, kwargs, check_time)
+                    continue
+                delivery = (args, kwargs)
+            elif (delivery := policy.offer(args, kwargs, now)) is None:
+                continue
+            future = self._deliver(observer, *delivery, policy)
+            if future is not None:
+                futures[future] = observer
+        if policies:
+            self._wake_timer()
+        if self.dispatch == "thread" and self.timeout is not None and futures:
+            _, pending = wait(futures, self.timeout)
+            for future in pending:
+                self.errors.append((futures[future], TimeoutError("观察者处理超时")))
+        elif self.dispatch == "async":
+            return asyncio.gather(*futures)
+
+    def _wake_timer(self):
+        with self._timer_wakeup:
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer, name="observer-timer", daemon=True)
+                self._timer.start()
+            self._timer_wakeup.notify()
+
+    def _run_timer(self):
+        """后台计时线程：在最近的截止时间醒来，送达到期的节流 / 防抖 / 批量读数"""
+        while True:
+            with self._timer_wakeup:
+                if self._closed:
+                    return
+                deadlines = [d for p in list(self._policies.values()) if (d := p.next_deadline()) is not None]
+                delay = min(deadlines) - time.monotonic() if deadlines else None
+                if delay is None or delay > 0:
+                    self._timer_wakeup.wait(delay)
+                    continue
+            now = time.monotonic()
+            for key, policy in list(self._policies.items()):
+                delivery = policy.due(now)
+                ref = self._observers.get(key)
+                observer = ref() if ref is not None else None
+                if delivery is None or observer is None:
+                    continue
+                if self.dispatch == "async":
+                    self._loop.call_soon_threadsafe(self._deliver, observer, *delivery, policy)
+                else:
+                    self._deliver(observer, *delivery, policy)
+
+    def _pending_deliveries(self):
+        """取出所有策略暂存的读数，返回 [(观察者, 送达, 策略)]"""
+        deliveries = []
+        for key, policy in list(self._policies.items()):
+            ref = self._observers.get(key)
+            observer = ref() if ref is not None else None
+            if observer is not None and (delivery := policy.flush()) is not None:
+                deliveries.append((observer, delivery, policy))
+        return deliveries
+
+    def flush(self):
+        """立即送出节流 / 防抖 / 批量策略暂存的读数（async 模式需在事件循环中调用）"""
+        for observer, delivery, policy in self._pending_deliveries():
+            self._deliver(observer, *delivery, policy)
+
+    def _stop_timer(self):
+        with self._timer_wakeup:
+            self._closed = True
+            self._timer_wakeup.notify()
+        if self._timer is not None:
+            self._timer.join()
+
+    def close(self):
+        """停止计时线程，送出所有暂存的读数，等观察者处理完后关闭线程池
+
+        async 模式请改用 aclose()。
+        """
+        self._stop_timer()
+        self.flush()
+        # 补送由完成回调链式提交，策略全部空闲才说明最后一条已经送达
+        while not all(policy.idle for policy in list(self._policies.values())):
+            time.sleep(0.001)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def aclose(self):
+        """async 模式的 close()：送出暂存的读数并等待观察者处理完"""
+        self._stop_timer()
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self.flush()
+        while not all(policy.idle for policy in list(self._policies.values())):
+            await asyncio.sleep(0.001)
+
+class ListObservable:
+    """原先的实现：观察者保存在列表中，增删是 O(n) 扫描且强引用观察者，仅用于对比"""
+
     def __init__(self):
         self._observers = []
-    
+
     def add_observer(self, observer):
-        """添加观察者"""
         if observer not in self._observers:
             self._observers.append(observer)
-    
+
     def remove_observer(self, observer):
-        """移除观察者"""
         if observer in self._observers:
             self._observers.remove(observer)
-    
+
     def notify_observers(self, *args, **kwargs):
-        """通知所有观察者"""
         for observer in self._observers:
             observer.update(self, *args, **kwargs)
 
 class WeatherStation(Observable):
     """气象站（被观察者）"""
     
-    def __init__(self):
-        super().__init__()
+    def __init__(self, echo=True, **options):
+        super().__init__(**options)
+        self.echo = echo  # 高频写入时关闭逐条打印
         self._temperature = 0
         self._humidity = 0
     
@@ -33,8 +457,9 @@ class WeatherStation(Observable):
         """设置天气数据"""
         self._temperature = temperature
         self._humidity = humidity
-        print(f"气象站更新: 温度={temperature}°C, 湿度={humidity}%")
-        self.notify_observers(temperature, humidity)
+        if self.echo:
+            print(f"气象站更新: 温度={temperature}°C, 湿度={humidity}%")
+        return self.notify_observers(temperature, humidity)
     
     @property
     def temperature(self):
@@ -73,6 +498,479 @@ weather_station.add_observer(website)
 weather_station.set_weather(25, 60)
 weather_station.set_weather(28, 65)
 
+# 弱引用：观察者被回收后自动注销
+temp_display = PhoneDisplay()
+weather_station.add_observer(temp_display)
+print(f"注册观察者数: {len(weather_station.observers)}")
+del temp_display
+print(f"临时观察者回收后: {len(weather_station.observers)}")
+
+class SlowDisplay(Observer):
+    """处理很慢的观察者"""
+
+    def update(self, weather_station, temperature, humidity):
+        time.sleep(0.5)
+
+class BrokenDisplay(Observer):
+    """总是出错的观察者"""
+
+    def update(self, weather_station, temperature, humidity):
+        raise RuntimeError("显示屏故障")
+
+class AsyncDisplay(Observer):
+    """update 是协程的观察者，用于 async 模式"""
+
+    async def update(self, weather_station, temperature, humidity):
+        await asyncio.sleep(0.01)
+        print(f"异步显示: {temperature}°C, {humidity}%")
+
+# 线程池通知：慢观察者和出错的观察者都不会拖住气象站
+slow, broken = SlowDisplay(), BrokenDisplay()
+threaded_station = WeatherStation(dispatch="thread", timeout=0.1)
+for observer in (phone, slow, broken):
+    threaded_station.add_observer(observer)
+start = time.perf_counter()
+threaded_station.set_weather(30, 70)
+print(f"发布耗时 {time.perf_counter() - start:.2f}s, 错误: "
+      f"{[(type(o).__name__, str(e)) for o, e in threaded_station.errors]}")
+threaded_station.close()
+
+class SlottedDisplay:
+    """__slots__ 中没有 __weakref__，只能被强引用"""
+
+    __slots__ = ("received",)
+
+    def __init__(self):
+        self.received = []
+
+    def update(self, weather_station, temperature, humidity):
+        time.sleep(0.001)  # 处理慢于发布，读数会在它的送达队列中排队
+        self.received.append(temperature)
+
+slotted = SlottedDisplay()
+ordered_station = WeatherStation(echo=False, dispatch="thread", max_workers=4)
+ordered_station.add_observer(slotted)
+for i in range(200):
+    ordered_station.set_weather(i, 50)
+ordered_station.close()
+assert slotted.received == list(range(200)), "同一观察者的读数应按发布顺序逐条送达"
+print(f"不支持弱引用的观察者: 按顺序收到 {len(slotted.received)} 条, 注册数 {len(ordered_station.observers)}")
+
+async def async_observer_demo():
+    station = WeatherStation(dispatch="async", timeout=0.1)
+    async_display = AsyncDisplay()
+    station.add_observer(async_display)
+    station.add_observer(broken)
+    station.set_weather(22, 50)
+    await station.notify_observers(23, 55)
+    print(f"async 模式错误: {[str(e) for _, e in station.errors]}")
+
+asyncio.run(async_observer_demo())
+
+# 合并策略：传感器高频写入，各显示屏按自己的节奏接收
+class RecordingDisplay(Observer):
+    """记录收到的读数，delay 模拟渲染耗时"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = []
+
+    def update(self, weather_station, *reading):
+        if self.delay:
+            time.sleep(self.delay)
+        self.received.append(reading)
+
+def coalescing_demo(readings=5_500, duration=0.5):
+    station = WeatherStation(echo=False, dispatch="thread")
+    displays = {
+        "不合并": (RecordingDisplay(), None),
+        "最新值优先(慢屏 20ms)": (RecordingDisplay(delay=0.02), LatestWins()),
+        "节流 100ms": (RecordingDisplay(), Throttle(0.1)),
+        "防抖 50ms": (RecordingDisplay(), Debounce(0.05)),
+        "批量 100ms": (RecordingDisplay(), Batch(interval=0.1)),
+        "批量每 1000 条": (RecordingDisplay(), Batch(max_size=1000)),
+    }
+    for display, policy in displays.values():
+        station.add_observer(display, policy)
+    start = time.perf_counter()
+    for i in range(readings):
+        station.set_weather(20 + i % 10, i)
+        # 均匀地把读数分散到 duration 秒内
+        if (lag := start + duration * (i + 1) / readings - time.perf_counter()) > 0:
+            time.sleep(lag)
+    station.close()  # 关闭时送出节流 / 防抖 / 批量暂存的最后一批读数
+    for label, (display, _) in displays.items():
+        received = display.received
+        if label.startswith("批量"):
+            flat = [reading for (batch,) in received for reading in batch]
+            print(f"  {label}: 送达 {len(received)} 次, 共 {len(flat)} 条读数, 最后一条 {flat[-1]}")
+        else:
+            print(f"  {label}: 送达 {len(received)} 次, 最后一条 {received[-1]}")
+
+coalescing_demo()
+
+class CountingObserver(Observer):
+    """只计数的观察者，用于基准测试"""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+    def update(self, observable, *args, **kwargs):
+        self.count += 1
+
+def benchmark_observers(counts=(10, 100, 1_000, 10_000), rounds=5):
+    """不同观察者数量下的单次发布延迟，以及注册 / 注销全部观察者的耗时"""
+    for n in counts:
+        observers = [CountingObserver() for _ in range(n)]
+        timings = []
+
+        for label, observable in (("列表", ListObservable()), ("sync", Observable()),
+                                  ("thread", Observable(dispatch="thread", timeout=5))):
+            for observer in observers:
+                observable.add_observer(observer)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                observable.notify_observers(1, 2)
+            timings.append(f"{label} {(time.perf_counter() - start) / rounds * 1e3:.2f}ms")
+            if isinstance(observable, Observable):
+                observable.close()
+
+        async def publish_async():
+            observable = Observable(dispatch="async", timeout=5)
+            for observer in observers:
+                observable.add_observer(observer)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                await observable.notify_observers(1, 2)
+            return (time.perf_counter() - start) / rounds
+
+        timings.append(f"async {asyncio.run(publish_async()) * 1e3:.2f}ms")
+
+        churn = []
+        for label, observable in (("列表", ListObservable()), ("弱引用字典", Observable())):
+            start = time.perf_counter()
+            for observer in observers:
+                observable.add_observer(observer)
+            for observer in observers:
+                observable.remove_observer(observer)
+            churn.append(f"{label} {(time.perf_counter() - start) * 1e3:.1f}ms")
+        print(f"  {n} 个观察者: 发布 " + ", ".join(timings) + "; 增删全部 " + ", ".join(churn))
+
+benchmark_observers()
+
+
+print("\n------------时序存储------------")
+
+import mmap
+import os
+import pickle
+import struct
+from array import array
+from bisect import bisect_left
+
+def _zigzag_varint(buf, value):
+    """有符号整数 zigzag 后按 7 位一组写入 bytearray，小的数只占 1 字节"""
+    z = (value << 1) ^ (value >> 63)
+    while z >= 0x80:
+        buf.append((z & 0x7F) | 0x80)
+        z >>= 7
+    buf.append(z)
+
+class _Segment:
+    """一个数据段：时间戳按块做 delta-of-delta 编码，数值列为定点 int16
+
+    每 BLOCK 个点为一块，块首时间戳和块在编码字节中的偏移存入稀疏索引，
+    范围查询只解码与区间相交的块。
+    """
+
+    BLOCK = 1024
+    # 魔数, 4 字节填充, 点数, 块数, 时间戳编码字节数；共 32 字节，后面的数组从 8 字节边界开始
+    HEADER = struct.Struct("<4s4xQQQ")
+    MAGIC = b"TSS2"
+
+    def __init__(self, columns):
+        self.count = 0
+        self.block_ts = array("q")
+        self.block_off = array("q")
+        self.ts_bytes = bytearray()
+        self.columns = [array("h") for _ in range(columns)]
+        self._prev = self._delta = 0
+        self._mmap = None
+
+    @property
+    def first_ts(self):
+        return self.block_ts[0]
+
+    @property
+    def nbytes(self):
+        return (len(self.ts_bytes) + 16 * len(self.block_ts)
+                + sum(2 * len(column) for column in self.columns))
+
+    def append(self, ts, values):
+        if self.count % self.BLOCK == 0:
+            self.block_ts.append(ts)
+            self.block_off.append(len(self.ts_bytes))
+            self._delta = 0  # 每块重新开始，块可以独立解码
+        else:
+            delta = ts - self._prev
+            _zigzag_varint(self.ts_bytes, delta - self._delta)
+            self._delta = delta
+        self._prev = ts
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.count += 1
+
+    def decode_block(self, b):
+        """还原第 b 块的全部时间戳"""
+        data, pos = self.ts_bytes, self.block_off[b]
+        ts, delta = self.block_ts[b], 0
+        out = [ts]
+        for _ in range(min(self.BLOCK, self.count - b * self.BLOCK) - 1):
+            z = shift = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                z |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            delta += (z >> 1) ^ -(z & 1)
+            ts += delta
+            out.append(ts)
+        return out
+
+    def last_ts(self):
+        return self._prev if self._mmap is None else self.decode_block(len(self.block_ts) - 1)[-1]
+
+    def scan(self, start, end):
+        """产出 [start, end) 内的 (ts, 行号)"""
+        first = max(0, bisect_left(self.block_ts, start) - 1)
+        last = bisect_left(self.block_ts, end)
+        for b in range(first, last):
+            base = b * self.BLOCK
+            for i, ts in enumerate(self.decode_block(b)):
+                if ts >= end:
+                    return
+                if ts >= start:
+                    yield ts, base + i
+
+    def save(self, path):
+        """写成段文件：头部、稀疏索引、各数值列、时间戳编码，数组部分按 8 字节对齐"""
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.count, len(self.block_ts), len(self.ts_bytes)))
+            f.write(self.block_ts.tobytes())
+            f.write(self.block_off.tobytes())
+            for column in self.columns:
+                f.write(column.tobytes())
+                f.write(b"\0" * (-2 * len(column) % 8))
+            f.write(self.ts_bytes)
+
+    @classmethod
+    def load(cls, path, columns):
+        """映射段文件，索引和数值列都是映射区上的 memoryview，不读入内存"""
+        segment = cls.__new__(cls)
+        with open(path, "rb") as f:
+            segment._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(segment._mmap)
+        magic, count, blocks, ts_len = cls.HEADER.unpack_from(view)
+        if magic != cls.MAGIC:
+            raise ValueError(f"不是时序段文件: {path}")
+        pos = cls.HEADER.size
+        segment.count = count
+        segment.block_ts = view[pos:pos + 8 * blocks].cast("q")
+        segment.block_off = view[pos + 8 * blocks:pos + 16 * blocks].cast("q")
+        pos += 16 * blocks
+        segment.columns = []
+        for _ in range(columns):
+            segment.columns.append(view[pos:pos + 2 * count].cast("h"))
+            pos += 2 * count + (-2 * count % 8)
+        segment.ts_bytes = view[pos:pos + ts_len]
+        return segment
+
+class _Rollup:
+    """按固定时间宽度预聚合：每个桶的 count 以及各列的 min / max / sum"""
+
+    def __init__(self, width, columns):
+        self.width = width
+        self.buckets = array("q")
+        self.count = array("q")
+        self.stats = [(array("d"), array("d"), array("d")) for _ in range(columns)]
+
+    def add(self, ts, values):
+        bucket = ts - ts % self.width
+        if not self.buckets or self.buckets[-1] != bucket:
+            self.buckets.append(bucket)
+            self.count.append(0)
+            for (low, high, total), value in zip(self.stats, values):
+                low.append(value)
+                high.append(value)
+                total.append(0.0)
+        self.count[-1] += 1
+        for (low, high, total), value in zip(self.stats, values):
+            if value < low[-1]:
+                low[-1] = value
+            elif value > high[-1]:
+                high[-1] = value
+            total[-1] += value
+
+    def query(self, start, end):
+        """[start, end) 内每个桶的 (桶起点, count, (min, max, mean), ...)"""
+        rows = []
+        for i in range(bisect_left(self.buckets, start - start % self.width), bisect_left(self.buckets, end)):
+            n = self.count[i]
+            rows.append((self.buckets[i], n,
+                         *((low[i], high[i], total[i] / n) for low, high, total in self.stats)))
+        return rows
+
+class TimeSeriesStore:
+    """气象读数的只追加列式时序存储（也可以直接作为 WeatherStation 的观察者）
+
+    - 时间戳（毫秒）按块做 delta-of-delta + zigzag varint 编码，等间隔采样时每点约 1 字节
+    - 温度、湿度按 0.1 精度存为 array("h")，每列每点 2 字节
+    - 写满 segment_points 个点的段封存为段文件，重新打开时用 mmap 映射
+    - 写入时同步维护按分钟、按小时的 min / max / mean 汇总
+    - 未写满的当前段和汇总只在内存中，flush() / close() 或段写满时才落盘
+    """
+
+    COLUMNS = ("temperature", "humidity")
+    SCALE = 10  # 定点精度 0.1
+    ROLLUPS = {"minute": 60_000, "hour": 3_600_000}
+
+    def __init__(self, directory=None, segment_points=1 << 16):
+        self.directory = directory
+        self.segment_points = segment_points
+        self.segments = []
+        self.rollups = {name: _Rollup(width, len(self.COLUMNS)) for name, width in self.ROLLUPS.items()}
+        self._head = _Segment(len(self.COLUMNS))
+        self._last_ts = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".tss"))
+        self.segments = [_Segment.load(os.path.join(self.directory, n), len(self.COLUMNS)) for n in names]
+        rollup_path = os.path.join(self.directory, "rollups.pkl")
+        if os.path.exists(rollup_path):
+            with open(rollup_path, "rb") as f:
+                self.rollups = pickle.load(f)
+        if self.segments:
+            self._last_ts = self.segments[-1].last_ts()
+
+    def __len__(self):
+        return sum(segment.count for segment in self.segments) + self._head.count
+
+    @property
+    def nbytes(self):
+        return sum(segment.nbytes for segment in self.segments) + self._head.nbytes
+
+    def append(self, ts, temperature, humidity):
+        """追加一个读数，ts 为毫秒时间戳，必须不早于上一个读数"""
+        if self._last_ts is not None and ts < self._last_ts:
+            raise ValueError(f"时间戳必须单调不减: {ts} < {self._last_ts}")
+        self._last_ts = ts
+        scale = self.SCALE
+        self._head.append(ts, (round(temperature * scale), round(humidity * scale)))
+        for rollup in self.rollups.values():
+            rollup.add(ts, (temperature, humidity))
+        if self._head.count >= self.segment_points:
+            self.flush()
+
+    def update(self, weather_station, temperature, humidity):
+        """观察者接口：记录 WeatherStation 广播的每个读数"""
+        self.append(time.time_ns() // 1_000_000, temperature, humidity)
+
+    def flush(self):
+        """封存当前写入段；指定了目录时写成段文件并改为 mmap 映射"""
+        if not self._head.count:
+            return
+        segment = self._head
+        if self.directory is not None:
+            path = os.path.join(self.directory, f"seg-{len(self.segments):06d}.tss")
+            segment.save(path)
+            segment = _Segment.load(path, len(self.COLUMNS))
+            with open(os.path.join(self.directory, "rollups.pkl"), "wb") as f:
+                pickle.dump(self.rollups, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.segments.append(segment)
+        self._head = _Segment(len(self.COLUMNS))
+
+    def scan(self, start, end):
+        """按时间顺序产出 [start, end) 内的 (ts, temperature, humidity)"""
+        scale = self.SCALE
+        for segment in self.segments + [self._head]:
+            if not segment.count or segment.first_ts >= end:
+                continue
+            temperature, humidity = segment.columns
+            for ts, i in segment.scan(start, end):
+                yield ts, temperature[i] / scale, humidity[i] / scale
+
+    def rollup(self, resolution, start, end):
+        """预聚合查询，resolution 为 "minute" 或 "hour"
+
+        返回 [(桶起点, count, (温度 min, max, mean), (湿度 min, max, mean)), ...]
+        """
+        return self.rollups[resolution].query(start, end)
+
+    def close(self):
+        """落盘当前段和汇总，并释放所有段文件的映射"""
+        self.flush()
+        for segment in self.segments:
+            if segment._mmap is not None:
+                segment.block_ts.release()
+                segment.block_off.release()
+                segment.ts_bytes.release()
+                for column in segment.columns:
+                    column.release()
+                segment._mmap.close()
+        self.segments = []
+
+def benchmark_time_series(points=200_000, interval_ms=1_000):
+    """写入吞吐、每点字节数，以及 1 小时 / 1 天范围查询的延迟"""
+    import random
+    import tempfile
+
+    rng = random.Random(0)
+    start_ts = 1_700_000_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TimeSeriesStore(tmp)
+        temperature, ts = 20.0, start_ts
+        t0 = time.perf_counter()
+        for _ in range(points):
+            ts += interval_ms + rng.choice((0, 0, 0, 1, -1))  # 采样时间带一点抖动
+            temperature += rng.uniform(-0.1, 0.1)
+            store.append(ts, temperature, 50 + 10 * rng.random())
+        store.close()
+        write = time.perf_counter() - t0
+        disk = sum(os.path.getsize(os.path.join(tmp, n)) for n in os.listdir(tmp) if n.endswith(".tss"))
+        store = TimeSeriesStore(tmp)
+        assert len(store) == points, "close() 之后重新打开应能读到全部数据"
+        assert _Segment.HEADER.size % 8 == 0, "段头必须保持数组 8 字节对齐"
+        print(f"  写入 {points} 点: {points / write / 1e3:.0f}k 点/s, 内存 {store.nbytes / points:.2f} 字节/点,"
+              f" 段文件 {disk / points:.2f} 字节/点 (原始 3 个 8 字节字段为 24 字节/点)")
+        for label, span in (("1 小时", 3_600_000), ("1 天", 86_400_000)):
+            begin = start_ts + (ts - start_ts) // 2
+            t0 = time.perf_counter()
+            rows = sum(1 for _ in store.scan(begin, begin + span))
+            scan = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            buckets = store.rollup("minute" if span <= 3_600_000 else "hour", begin, begin + span)
+            rollup = time.perf_counter() - t0
+            print(f"  {label}范围: 扫描 {rows} 点 {scan * 1e3:.1f}ms, 汇总 {len(buckets)} 桶 {rollup * 1e3:.2f}ms")
+        store.close()
+
+# 直接挂在气象站上，记录每一条广播的读数
+series = TimeSeriesStore()
+recording_station = WeatherStation(echo=False)
+recording_station.add_observer(series)
+for i in range(5):
+    recording_station.set_weather(25 + i * 0.5, 60 - i)
+now_ms = time.time_ns() // 1_000_000
+print(f"已记录 {len(series)} 个读数: {[reading[1:] for reading in series.scan(0, now_ms + 1)]}")
+print(f"按分钟汇总: {series.rollup('minute', 0, now_ms + 1)}")
+benchmark_time_series()
+
 
 print("\n------------策略模式------------")
 
@@ -121,26 +1019,152 @@ class WechatPayment(PaymentStrategy):
     def pay(self, amount: float) -> str:
         return f"使用微信支付 ¥{amount:.2f} (OpenID: {self.openid[:8]}...)"
 
-from typing import List, Tuple, Optional
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Tuple, Optional, Union
+
+Money = Union[int, str, Decimal, float]
+
+def to_minor_units(price: Money) -> int:
+    """把金额换算成整数分；float 先按字符串转换，避免 0.1 这类二进制误差"""
+    if isinstance(price, int):
+        return price * 100
+    cents = Decimal(str(price)) * 100
+    return int(cents.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_minor_units(minor: int) -> Decimal:
+    """整数分转回精确的 Decimal 元"""
+    return Decimal(minor).scaleb(-2)
 
 class ShoppingCart:
-    """购物车类"""
+    """购物车类
+
+    金额以整数分保存，按 SKU 聚合数量（字典索引），总额在增删时增量维护，
+    结账不再重新求和。每个 SKU 对应一个不可变的 (单价(分), 数量) 元组：
+    批量添加时数量相同的行共用同一个元组，10^6 行不会分配 10^6 个列表。
+    """
+
+    SUMMARY_LINES = 20  # 结账时超过这么多种商品就只打印汇总
     
     def __init__(self) -> None:
-        self.items: List[Tuple[str, float]] = []
+        self._lines: Dict[str, Tuple[int, int]] = {}  # SKU -> (单价(分), 数量)
+        self._total_minor = 0
+        self._quantity = 0
         self.payment_strategy: Optional[PaymentStrategy] = None
     
-    def add_item(self, item: str, price: float) -> None:
-        """添加商品"""
-        self.items.append((item, price))
+    def add_item(self, item: str, price: Money, quantity: int = 1) -> None:
+        """添加商品；同一 SKU 累加数量
+        
+        Raises:
+            ValueError: 数量不是正数，或同一 SKU 的单价与已有的不一致
+        """
+        if quantity <= 0:
+            raise ValueError(f"数量必须为正数: {quantity}")
+        unit = to_minor_units(price)
+        line = self._lines.get(item)
+        if line is None:
+            self._lines[item] = (unit, quantity)
+        elif line[0] != unit:
+            raise self._price_mismatch(item, line[0], unit)
+        else:
+            self._lines[item] = (unit, line[1] + quantity)
+        self._total_minor += unit * quantity
+        self._quantity += quantity
+    
+    def bulk_add(self, rows: Iterable[Tuple]) -> int:
+        """批量添加 (商品, 单价) 或 (商品, 单价, 数量)，返回添加的行数
+
+        与逐条 add_item 的校验相同。每个不同的单价只换算一次，两列的行直接复用
+        缓存的 (单价(分), 1) 元组，循环内没有 Decimal 运算；总额最后一次性更新。
+        """
+        lines, get = self._lines, self._lines.get
+        singles: Dict[Money, Tuple[int, int]] = {}  # 单价原值 -> (单价(分), 1)
+        total = quantity_sum = count = 0
+        try:
+            for row in rows:
+                item, price = row[0], row[1]
+                entry = singles.get(price)
+                if entry is None:
+                    entry = singles[price] = (to_minor_units(price), 1)
+                if len(row) > 2:
+                    quantity = row[2]
+                    if quantity <= 0:
+                        raise ValueError(f"数量必须为正数: {quantity}")
+                    entry = (entry[0], quantity)
+                line = get(item)
+                if line is None:
+                    lines[item] = entry
+                elif line[0] != entry[0]:
+                    raise self._price_mismatch(item, line[0], entry[0])
+                else:
+                    lines[item] = (line[0], line[1] + entry[1])
+                total += entry[0] * entry[1]
+                quantity_sum += entry[1]
+                count += 1
+        finally:
+            # 中途出错时已写入的行也计入总额，保持索引与总额一致
+            self._total_minor += total
+            self._quantity += quantity_sum
+        return count
+
+    @staticmethod
+    def _price_mismatch(item: str, held: int, unit: int) -> ValueError:
+        """同一 SKU 单价冲突时的异常，add_item 与 bulk_add 共用"""
+        return ValueError(f"商品 {item} 的单价不一致: {from_minor_units(held)} != {from_minor_units(unit)}")
+    
+    def remove_item(self, item: str, quantity: Optional[int] = None) -> None:
+        """移除商品；quantity 为 None 时移除该 SKU 的全部数量
+        
+        Raises:
+            ValueError: 购物车中没有该商品，或要移除的数量超过已有数量
+        """
+        line = self._lines.get(item)
+        if line is None:
+            raise ValueError(f"购物车中没有商品: {item}")
+        unit, held = line
+        quantity = held if quantity is None else quantity
+        if not 0 < quantity <= held:
+            raise ValueError(f"商品 {item} 只有 {held} 件，无法移除 {quantity} 件")
+        if quantity == held:
+            del self._lines[item]
+        else:
+            self._lines[item] = (unit, held - quantity)
+        self._total_minor -= unit * quantity
+        self._quantity -= quantity
+    
+    @property
+    def items(self) -> List[Tuple[str, Decimal]]:
+        """(商品, 单价) 列表，与原先逐件添加的视图一致：数量为 n 的商品出现 n 次"""
+        return [(item, from_minor_units(unit)) for item, (unit, quantity) in self._lines.items()
+                for _ in range(quantity)]
+
+    @property
+    def lines(self) -> List[Tuple[str, Decimal, int]]:
+        """按 SKU 聚合的 (商品, 单价, 数量) 列表"""
+        return [(item, from_minor_units(unit), quantity) for item, (unit, quantity) in self._lines.items()]
+    
+    @property
+    def total(self) -> Decimal:
+        """当前总额（精确到分）"""
+        return from_minor_units(self._total_minor)
+    
+    def quantity(self, item: str) -> int:
+        """某个 SKU 的数量"""
+        line = self._lines.get(item)
+        return line[1] if line else 0
+    
+    def __len__(self) -> int:
+        return len(self._lines)
     
     def set_payment_strategy(self, strategy: PaymentStrategy) -> None:
         """设置支付策略"""
         self.payment_strategy = strategy
     
-    def checkout(self) -> str:
+    def checkout(self, summary: Optional[bool] = None) -> str:
         """结账
         
+        Args:
+            summary: True 只打印汇总，False 打印每一行；None 时超过 SUMMARY_LINES 种商品自动汇总
+        
         Raises:
             ValueError: 当未设置支付策略时
             
@@ -150,12 +1174,41 @@ class ShoppingCart:
         if not self.payment_strategy:
             raise ValueError("请设置支付策略")
         
+        total = self.total
+        if summary is None:
+            summary = len(self._lines) > self.SUMMARY_LINES
+        if summary:
+            print(f"商品清单: {len(self._lines)} 种, 共 {self._quantity} 件")
+        else:
+            print(f"商品清单:")
+            for item, (unit, quantity) in self._lines.items():
+                suffix = f" x{quantity}" if quantity > 1 else ""
+                print(f"  {item}{suffix}: ¥{from_minor_units(unit * quantity):.2f}")
+        print(f"总计: ¥{total:.2f}")
+        
+        return self.payment_strategy.pay(total)
+
+class ListShoppingCart:
+    """原先的实现：元组列表 + 每次结账重新求和并逐行打印，仅用于对比"""
+
+    def __init__(self) -> None:
+        self.items: List[Tuple[str, float]] = []
+        self.payment_strategy: Optional[PaymentStrategy] = None
+
+    def add_item(self, item: str, price: float) -> None:
+        self.items.append((item, price))
+
+    def set_payment_strategy(self, strategy: PaymentStrategy) -> None:
+        self.payment_strategy = strategy
+
+    def checkout(self) -> str:
+        if not self.payment_strategy:
+            raise ValueError("请设置支付策略")
         total = sum(price for _, price in self.items)
         print(f"商品清单:")
         for item, price in self.items:
             print(f"  {item}: ¥{price:.2f}")
         print(f"总计: ¥{total:.2f}")
-        
         return self.payment_strategy.pay(total)
 
 # 策略模式测试
@@ -170,6 +1223,393 @@ print(cart.checkout())
 cart.set_payment_strategy(AlipayPayment("user@example.com"))
 print(cart.checkout())
 
+# 数量、移除与精确金额
+cart.add_item("耳机", 299, quantity=2)
+cart.add_item("数据线", "19.90")
+cart.remove_item("耳机", 1)
+print(f"耳机数量: {cart.quantity('耳机')}, 总计: ¥{cart.total}")
+print(f"逐件视图: {cart.items}")
+print(f"聚合视图: {cart.lines}")
+try:
+    cart.bulk_add([("数据线", "29.90")])
+except ValueError as error:
+    print(f"单价冲突: {error}")
+cart.set_payment_strategy(WechatPayment("wx_openid_1234567890"))
+print(cart.checkout(summary=True))
+
+def benchmark_cart(lines=1_000_000):
+    """10^6 行的 B2B 购物车：原先的列表实现 vs 增量总额 + SKU 索引"""
+    import io
+    from contextlib import redirect_stdout
+
+    rows = [(f"SKU{i:07d}", "0.10") for i in range(lines)]
+    float_rows = [(item, 0.1) for item, _ in rows]
+    payment = AlipayPayment("b2b@example.com")
+
+    legacy = ListShoppingCart()
+    legacy.set_payment_strategy(payment)
+    start = time.perf_counter()
+    for item, price in float_rows:
+        legacy.add_item(item, price)
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = legacy.checkout()
+    checkout = time.perf_counter() - start
+    print(f"  列表实现: 添加 {added:.2f}s, 结账(逐行打印) {checkout:.2f}s, {result}")
+    print(f"    float 求和: {sum(price for _, price in legacy.items)!r}")
+
+    # bulk_add 仍比列表 append 慢，差距主要是 10^6 个 SKU 的哈希与字典扩容，
+    # 换来的是 O(1) 的按 SKU 合并、移除和不用重新求和的结账
+    fast = ShoppingCart()
+    fast.set_payment_strategy(payment)
+    start = time.perf_counter()
+    fast.bulk_add(rows)
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        result = fast.checkout()
+    checkout = time.perf_counter() - start
+    print(f"  增量实现: bulk_add {added:.2f}s, 结账(汇总) {checkout * 1e6:.0f}µs, {result}")
+    print(f"    精确总额: {fast.total!r}")
+    start = time.perf_counter()
+    fast.remove_item(f"SKU{lines // 2:07d}")
+    print(f"  移除 1 行: {(time.perf_counter() - start) * 1e6:.1f}µs, 总额 ¥{fast.total}")
+
+benchmark_cart()
+
+import random
+from itertools import chain, zip_longest
+from typing import NamedTuple
+
+def _payment_fingerprint(strategy: PaymentStrategy, amount: Money) -> Tuple[type, int]:
+    """幂等键对应的支付内容：策略类型 + 金额(分)"""
+    return type(strategy), to_minor_units(amount)
+
+def _check_key_reuse(key: str, held: Tuple[type, int], fingerprint: Tuple[type, int]) -> None:
+    """同一个幂等键只能用于同一笔支付，内容不同说明调用方复用了键"""
+    if held != fingerprint:
+        raise ValueError(f"幂等键 {key} 已用于另一笔支付: {held[0].__name__} ¥{from_minor_units(held[1])}, "
+                         f"本次为 {fingerprint[0].__name__} ¥{from_minor_units(fingerprint[1])}")
+
+class SimulatedGateway:
+    """本地模拟的支付网关，用于压测
+
+    每次扣款耗时 latency ± jitter 秒；以 failure_rate 的概率在扣款成功后丢失响应
+    （抛出 ConnectionError），模拟最危险的「钱扣了但调用方不知道」的情况。
+    网关按幂等键记住结果和支付内容：同一个键重试时直接返回原结果，不会重复扣款；
+    同一个键换了策略类型或金额则抛出 ValueError。
+    """
+
+    def __init__(self, latency=0.002, jitter=0.001, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._processed: Dict[str, Tuple[Tuple[type, int], str]] = {}  # 键 -> (支付内容, 结果)
+        self.charges = 0  # 实际扣款次数
+        self.charged_minor = 0
+
+    def _delay(self):
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _commit(self, strategy, amount, key):
+        fingerprint = _payment_fingerprint(strategy, amount)
+        with self._lock:
+            if key is not None and key in self._processed:
+                held, result = self._processed[key]
+                _check_key_reuse(key, held, fingerprint)
+                return result
+            result = strategy.pay(amount)
+            self.charges += 1
+            self.charged_minor += fingerprint[1]
+            if key is not None:
+                self._processed[key] = fingerprint, result
+            lost = self._rng.random() < self.failure_rate
+        if lost:
+            raise ConnectionError("网关响应丢失")
+        return result
+
+    def charge(self, strategy, amount, key=None):
+        time.sleep(self._delay())
+        return self._commit(strategy, amount, key)
+
+    async def charge_async(self, strategy, amount, key=None):
+        await asyncio.sleep(self._delay())
+        return self._commit(strategy, amount, key)
+
+class GatewayPayment(PaymentStrategy):
+    """把任意支付策略接到网关上，让 ShoppingCart.checkout 也经过模拟延迟"""
+
+    def __init__(self, inner: PaymentStrategy, gateway: SimulatedGateway) -> None:
+        self.inner = inner
+        self.gateway = gateway
+
+    def pay(self, amount: float) -> str:
+        return self.gateway.charge(self.inner, amount)
+
+class RateLimiter:
+    """令牌桶限速：每秒 rate 次，允许 burst 次突发
+
+    采用预约方式：取令牌时直接扣减（可以为负），返回需要等待的时间，
+    线程和协程共用同一套逻辑。
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        if burst is not None and burst < 0:
+            raise ValueError(f"burst 不能为负数: {burst}")
+        self.rate = rate
+        # burst=0 表示不允许突发，不能当作未指定
+        self.capacity = max(1, int(rate // 10)) if burst is None else burst
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> None:
+        if (wait := self._reserve()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        if (wait := self._reserve()) > 0:
+            await asyncio.sleep(wait)
+
+class PaymentRequest(NamedTuple):
+    """一笔待执行的支付，key 为幂等键"""
+    key: str
+    strategy: PaymentStrategy
+    amount: Decimal
+
+class BatchResult:
+    """一批支付的结果：成功结果、失败原因、每笔耗时和总耗时"""
+
+    def __init__(self) -> None:
+        self.results: Dict[str, str] = {}
+        self.failures: Dict[str, Exception] = {}
+        self.latencies: List[float] = []
+        self.groups: Dict[str, int] = {}
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+    def __str__(self) -> str:
+        return (f"{len(self.results)} 成功, {len(self.failures)} 失败, 跳过 {self.skipped}, "
+                f"{self.throughput:.0f} 笔/s, p50 {self.percentile(0.5) * 1e3:.1f}ms, "
+                f"p99 {self.percentile(0.99) * 1e3:.1f}ms")
+
+class BatchPaymentExecutor:
+    """并发批量支付
+
+    - 按策略类型分组，每组有各自的限速（rate_limits: {策略类: 每秒次数}）
+    - 全局并发上限 max_concurrency；mode 为 "thread"（线程池）或 "async"（asyncio）
+    - 幂等：同一个键在批内只执行一次，已成功的键再次提交会被跳过；
+      网络错误时用同一个键重试，网关据此去重，不会重复扣款。
+      同一个键对应的策略类型或金额不同时，run 在执行任何支付前抛出 ValueError
+    - 其他异常只记入 failures，不会中断整批，已完成的支付结果不会丢失
+    """
+
+    MODES = ("thread", "async")
+
+    def __init__(self, gateway: SimulatedGateway, max_concurrency: int = 64,
+                 rate_limits: Optional[Dict[type, float]] = None, mode: str = "thread",
+                 retries: int = 3) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"未知的执行方式: {mode}")
+        self.gateway = gateway
+        self.max_concurrency = max_concurrency
+        self.mode = mode
+        self.retries = retries
+        self._limiters = {cls: RateLimiter(rate) for cls, rate in (rate_limits or {}).items()}
+        self._completed: Dict[str, Tuple[Tuple[type, int], str]] = {}  # 键 -> (支付内容, 结果)
+
+    def _plan(self, requests: Iterable[PaymentRequest], report: BatchResult) -> List[PaymentRequest]:
+        """去掉已完成和批内重复的键，并按策略类型分组排列
+
+        Raises:
+            ValueError: 同一个键对应的支付内容与已完成或批内先出现的不一致
+        """
+        groups: Dict[type, List[PaymentRequest]] = {}
+        seen: Dict[str, Tuple[type, int]] = {}
+        for request in requests:
+            fingerprint = _payment_fingerprint(request.strategy, request.amount)
+            if request.key in self._completed:
+                held, result = self._completed[request.key]
+                _check_key_reuse(request.key, held, fingerprint)
+                report.results[request.key] = result
+                report.skipped += 1
+            elif request.key in seen:
+                _check_key_reuse(request.key, seen[request.key], fingerprint)
+                report.skipped += 1
+            else:
+                seen[request.key] = fingerprint
+                groups.setdefault(type(request.strategy), []).append(request)
+        for cls, members in groups.items():
+            report.groups[cls.__name__] = len(members)
+        # 各组交错排列，避免某一组的限速挡住其他组
+        return [request for request in chain.from_iterable(zip_longest(*groups.values()))
+                if request is not None]
+
+    def _record(self, report: BatchResult, request: PaymentRequest, started: float, result=None, error=None):
+        report.latencies.append(time.perf_counter() - started)
+        if error is None:
+            report.results[request.key] = result
+            self._completed[request.key] = _payment_fingerprint(request.strategy, request.amount), result
+        else:
+            report.failures[request.key] = error
+
+    def _execute(self, request: PaymentRequest, report: BatchResult) -> None:
+        started = time.perf_counter()
+        limiter = self._limiters.get(type(request.strategy))
+        for attempt in range(self.retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                result = self.gateway.charge(request.strategy, request.amount, request.key)
+            except ConnectionError as exc:
+                if attempt == self.retries:
+                    self._record(report, request, started, error=exc)
+                    return
+                time.sleep(0.001 * 2 ** attempt)
+            except Exception as exc:  # 其他错误不重试，只记为这一笔失败，不影响整批
+                self._record(report, request, started, error=exc)
+                return
+            else:
+                self._record(report, request, started, result)
+                return
+
+    async def _execute_async(self, request: PaymentRequest, report: BatchResult,
+                             semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            limiter = self._limiters.get(type(request.strategy))
+            for attempt in range(self.retries + 1):
+                if limiter is not None:
+                    await limiter.acquire_async()
+                try:
+                    result = await self.gateway.charge_async(request.strategy, request.amount, request.key)
+                except ConnectionError as exc:
+                    if attempt == self.retries:
+                        self._record(report, request, started, error=exc)
+                        return
+                    await asyncio.sleep(0.001 * 2 ** attempt)
+                except Exception as exc:  # 其他错误不重试，只记为这一笔失败，不影响整批
+                    self._record(report, request, started, error=exc)
+                    return
+                else:
+                    self._record(report, request, started, result)
+                    return
+
+    async def run_async(self, requests: Iterable[PaymentRequest]) -> BatchResult:
+        report = BatchResult()
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.gather(*(self._execute_async(request, report, semaphore)
+                               for request in self._plan(requests, report)))
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def run(self, requests: Iterable[PaymentRequest]) -> BatchResult:
+        """执行一批支付；async 模式下在新的事件循环中运行 run_async"""
+        if self.mode == "async":
+            return asyncio.run(self.run_async(requests))
+        report = BatchResult()
+        start = time.perf_counter()
+        plan = self._plan(requests, report)
+        with ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="payment") as pool:
+            for future in [pool.submit(self._execute, request, report) for request in plan]:
+                future.result()
+        report.elapsed = time.perf_counter() - start
+        return report
+
+def make_payments(n: int, seed: int = 0) -> List[PaymentRequest]:
+    """生成 n 笔三种策略混合的支付"""
+    rng = random.Random(seed)
+    strategies = [CreditCardPayment("1234567890123456", "123"),
+                  AlipayPayment("user@example.com"),
+                  WechatPayment("wx_openid_1234567890")]
+    return [PaymentRequest(f"order-{i}", strategies[i % 3], Decimal(rng.randint(100, 99_999)).scaleb(-2))
+            for i in range(n)]
+
+def benchmark_payments(n: int = 1_000, latency: float = 0.002):
+    """串行 checkout 与并发批量执行的吞吐和尾延迟对比"""
+    import io
+    from contextlib import redirect_stdout
+
+    payments = make_payments(n)
+    gateway = SimulatedGateway(latency=latency, seed=1)
+    latencies = []
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for request in payments:
+            serial_cart = ShoppingCart()
+            serial_cart.add_item(request.key, request.amount)
+            serial_cart.set_payment_strategy(GatewayPayment(request.strategy, gateway))
+            began = time.perf_counter()
+            serial_cart.checkout(summary=True)
+            latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"  串行 checkout: {n / elapsed:.0f} 笔/s, p50 {latencies[n // 2] * 1e3:.1f}ms, "
+          f"p99 {latencies[int(n * 0.99)] * 1e3:.1f}ms")
+
+    limits = {CreditCardPayment: 5_000, AlipayPayment: 5_000, WechatPayment: 2_000}
+    for mode in BatchPaymentExecutor.MODES:
+        gateway = SimulatedGateway(latency=latency, seed=1)
+        report = BatchPaymentExecutor(gateway, max_concurrency=64, rate_limits=limits, mode=mode).run(payments)
+        print(f"  批量 {mode}: {report}")
+
+# 幂等重试：网关有 20% 的概率扣款后丢失响应
+flaky = SimulatedGateway(latency=0.001, failure_rate=0.2, seed=7)
+executor = BatchPaymentExecutor(flaky, max_concurrency=16, mode="async",
+                                rate_limits={WechatPayment: 500})
+payments = make_payments(300)
+report = executor.run(payments + payments[:50])  # 批内重复提交的 50 笔只执行一次
+print(f"第一次执行: {report}, 分组 {report.groups}")
+report = executor.run(payments)  # 整批重跑，已成功的全部跳过
+print(f"整批重跑: {report}")
+expected = sum(to_minor_units(p.amount) for p in payments)
+print(f"网关实际扣款 {flaky.charges} 次, 金额一致: {flaky.charged_minor == expected}")
+reused = payments[0]._replace(amount=payments[0].amount + 1)
+try:
+    executor.run([reused])
+except ValueError as error:
+    print(f"复用幂等键: {error}")
+try:
+    flaky.charge(reused.strategy, reused.amount, reused.key)
+except ValueError as error:
+    print(f"网关拒绝复用的键: {error}")
+assert flaky.charged_minor == expected, "复用的键不应产生新的扣款"
+burst_free = RateLimiter(1000, burst=0)
+assert burst_free.capacity == 0 and burst_free._reserve() > 0, "burst=0 时第一次取令牌就要等待"
+
+class DeclinedPayment(PaymentStrategy):
+    """总是被拒绝的支付策略"""
+
+    def pay(self, amount: float) -> str:
+        raise ValueError("卡片被拒")
+
+for mode in BatchPaymentExecutor.MODES:
+    mixed = make_payments(20) + [PaymentRequest("order-declined", DeclinedPayment(), Decimal("9.99"))]
+    report = BatchPaymentExecutor(SimulatedGateway(latency=0.001), mode=mode).run(mixed)
+    print(f"{mode} 模式含一笔异常支付: {report}, 失败原因 {report.failures}")
+benchmark_payments()
+
 
 print("\n------------装饰器模式------------")
 
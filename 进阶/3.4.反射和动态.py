@@ -86,33 +86,206 @@ print(f"__dict__: {obj.__dict__}")
 methods = [name for name in dir(obj) if callable(getattr(obj, name)) and not name.startswith('__')]
 print(f"所有方法: {methods}")
 
+print("\n=== 反射索引 ===")
+
+import types
+import weakref
+from collections import namedtuple
+
+MemberInfo = namedtuple("MemberInfo", "name visibility kind owner")
+
+# 通过 IndexedMeta 修改过的类 -> 修改次数
+_class_versions = weakref.WeakKeyDictionary()
+
+
+class IndexedMeta(type):
+    """元类：类属性被设置或删除时递增版本号，使反射索引自动失效"""
+    
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        _class_versions[cls] = _class_versions.get(cls, 0) + 1
+    
+    def __delattr__(cls, name):
+        super().__delattr__(name)
+        _class_versions[cls] = _class_versions.get(cls, 0) + 1
+
+
+class ClassIndex:
+    """单个类的成员索引，按可见性和种类预先分好组"""
+    
+    def __init__(self, cls):
+        self.cls = cls
+        self.members = {}
+        # 沿 MRO 反向遍历，子类定义覆盖父类；直接读 __dict__，不触发 getattr
+        for klass in reversed(cls.__mro__[:-1]):
+            mangle_prefix = f"_{klass.__name__.lstrip('_')}__"
+            for name, value in klass.__dict__.items():
+                self.members[name] = MemberInfo(
+                    name, self._visibility(name, mangle_prefix), self._kind(value), klass)
+        self._groups = {}
+        for info in self.members.values():
+            self._groups.setdefault((info.visibility, info.kind), []).append(info.name)
+            if info.kind in ("method", "classmethod", "staticmethod"):
+                self._groups.setdefault((info.visibility, "callable"), []).append(info.name)
+        self._groups = {key: tuple(sorted(names)) for key, names in self._groups.items()}
+    
+    @staticmethod
+    def _visibility(name, mangle_prefix):
+        if name.startswith("__") and name.endswith("__"):
+            return "special"
+        if name.startswith(mangle_prefix):
+            return "private"
+        if name.startswith("_"):
+            return "protected"
+        return "public"
+    
+    @staticmethod
+    def _kind(value):
+        if isinstance(value, classmethod):
+            return "classmethod"
+        if isinstance(value, staticmethod):
+            return "staticmethod"
+        if isinstance(value, property):
+            return "property"
+        if isinstance(value, types.FunctionType) or callable(value) and hasattr(value, "__get__"):
+            return "method"
+        return "attribute"
+    
+    def names(self, visibility="public", kind="callable"):
+        """O(1) 查询，例如 names('public', 'callable') 返回可调用的公有方法"""
+        return self._groups.get((visibility, kind), ())
+
+
+class ReflectionIndex:
+    """按类缓存的反射索引
+
+    每个类只在第一次查询（或被修改后）构建一次索引。失效检测只看 MRO 上每个类的
+    __dict__ 大小，以及 IndexedMeta 记录的修改次数，开销与成员数量无关。
+    普通类上替换同名属性（大小不变）需要手动调用 invalidate()。
+    """
+    
+    def __init__(self):
+        self._cache = weakref.WeakKeyDictionary()
+        self.builds = 0
+    
+    @staticmethod
+    def _stamp(cls):
+        return tuple((len(k.__dict__), _class_versions.get(k, 0)) for k in cls.__mro__[:-1])
+    
+    def of(self, target):
+        """返回类（或实例所属类）的 ClassIndex"""
+        cls = target if isinstance(target, type) else type(target)
+        stamp = self._stamp(cls)
+        entry = self._cache.get(cls)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, ClassIndex(cls))
+            self._cache[cls] = entry
+            self.builds += 1
+        return entry[1]
+    
+    def methods(self, target, visibility="public"):
+        return self.of(target).names(visibility, "callable")
+    
+    def instance_attributes(self, obj):
+        """实例自身的数据属性按可见性分组（只看实例 __dict__）"""
+        mangle_prefix = f"_{type(obj).__name__.lstrip('_')}__"
+        groups = {}
+        for name in vars(obj):
+            groups.setdefault(ClassIndex._visibility(name, mangle_prefix), []).append(name)
+        return groups
+    
+    def invalidate(self, cls=None):
+        if cls is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(cls, None)
+
+
+reflection = ReflectionIndex()
+index = reflection.of(obj)
+print(f"公有方法: {index.names('public')}")
+print(f"受保护方法: {index.names('protected')}")
+print(f"私有(改写)方法: {index.names('private')}")
+print(f"类方法: {index.names('public', 'classmethod')}, 静态方法: {index.names('public', 'staticmethod')}")
+print(f"实例属性: {reflection.instance_attributes(obj)}")
+
+
+def benchmark_reflection(n=20_000):
+    """对比 dir()+getattr 扫描与缓存索引查询"""
+    import timeit
+
+    scan = lambda: [name for name in dir(obj) if callable(getattr(obj, name)) and not name.startswith('__')]
+    cached = lambda: reflection.methods(obj)
+    for label, fn in (("dir + getattr", scan), ("ReflectionIndex", cached)):
+        elapsed = min(timeit.repeat(fn, number=n, repeat=3)) / n
+        print(f"  {label}: {elapsed * 1e6:.2f}µs/次")
+
+benchmark_reflection()
+
 
 print("\n------------动态创建类和属性------------")
 
+from collections import OrderedDict
+
+# 生成 __init__/__repr__/__eq__ 的模板与 3.1 共用，放在同目录的 _record_codegen.py 中
+from _record_codegen import build_record_methods
+
+_DYNAMIC_CLASS_CACHE_SIZE = 128
+_dynamic_class_cache = OrderedDict()  # LRU：内联 lambda 每次都是新对象，必须限制容量
+
+
 def create_dynamic_class(class_name: str, attributes: dict, methods: dict = None):
-    """动态创建类"""
+    """动态创建类
+
+    Args:
+        class_name: 类名
+        attributes: 字段模式 {字段名: 类型}，用于生成 __init__/__slots__ 等
+        methods: 额外的方法
+
+    相同的类名、字段模式和方法对象会复用已生成的类（最多缓存
+    _DYNAMIC_CLASS_CACHE_SIZE 个，按最近使用淘汰）；方法值不可哈希时不缓存。
+    """
     if methods is None:
         methods = {}
+    if not class_name.isidentifier():
+        raise ValueError(f"无效的类名: {class_name}")
     
-    # 添加类方法
-    def __init__(self, **kwargs):
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+    try:
+        cache_key = (class_name, tuple(attributes.items()), tuple(methods.items()))
+        cached = _dynamic_class_cache.get(cache_key)
+    except TypeError:  # 方法值不可哈希（如 {"tags": []}）时不缓存
+        cache_key = cached = None
+    if cached is not None:
+        _dynamic_class_cache.move_to_end(cache_key)
+        return cached
     
     def __str__(self):
-        attrs = {k: v for k, v in self.__dict__.items()}
+        attrs = {k: getattr(self, k) for k in self._fields}
         return f"{class_name}({attrs})"
     
-    methods.update({
-        '__init__': __init__,
-        '__str__': __str__
-    })
+    namespace = build_record_methods(class_name, attributes)
+    namespace["__annotations__"] = dict(attributes)
+    namespace["__str__"] = __str__
+    namespace.update(methods)
     
     # 动态创建类
-    DynamicClass = type(class_name, (object,), methods)
+    DynamicClass = type(class_name, (object,), namespace)
+    if cache_key is not None:
+        _dynamic_class_cache[cache_key] = DynamicClass
+        if len(_dynamic_class_cache) > _DYNAMIC_CLASS_CACHE_SIZE:
+            _dynamic_class_cache.popitem(last=False)
     
     return DynamicClass
 
+
+def create_kwargs_class(class_name: str, methods: dict = None):
+    """旧版动态类：通用 **kwargs __init__，实例带 __dict__，仅用于对比"""
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+    
+    return type(class_name, (object,), {"__init__": __init__, **(methods or {})})
+
 # 动态创建类
 PersonClass = create_dynamic_class(
     "Person",
@@ -128,9 +301,36 @@ person = PersonClass(name="张三", age=25)
 print(f"动态创建的实例: {person}")
 print(f"自我介绍: {person.introduce()}")
 print(f"是否成年: {person.is_adult()}")
+print(f"repr: {person!r}, 相等: {person == PersonClass('张三', 25)}")
+print(f"实例有 __dict__ 吗: {hasattr(person, '__dict__')}")
+Tagged = create_dynamic_class("Tagged", {"name": str}, {"tags": []})
+print(f"不可哈希的方法值不缓存: {Tagged('x').tags}, 缓存数: {len(_dynamic_class_cache)}")
+
+
+def benchmark_dynamic_class(n=50_000):
+    """对比通用 **kwargs 类与代码生成类的实例化速度和单实例内存"""
+    import timeit
+    import tracemalloc
+
+    schema = {"name": str, "age": int, "email": str}
+    row = {"name": "张三", "age": 25, "email": "zhang@example.com"}
+    hit = min(timeit.repeat(lambda: create_dynamic_class("Record", schema), number=1000, repeat=3))
+    print(f"  重复创建（命中缓存）: {hit / 1000 * 1e6:.2f}µs/次")
+
+    for label, cls in (("**kwargs + __dict__", create_kwargs_class("Record")),
+                       ("生成 __init__ + __slots__", create_dynamic_class("Record", schema))):
+        elapsed = min(timeit.repeat(lambda: cls(**row), number=n, repeat=3)) / n
+        tracemalloc.start()
+        objs = [cls(**row) for _ in range(n)]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del objs
+        print(f"  {label}: {elapsed * 1e9:.0f}ns/实例, {memory / n:.0f} 字节/实例")
+
+benchmark_dynamic_class()
 
-# 动态添加属性和方法
-class DynamicAdd:
+# 动态添加属性和方法（IndexedMeta 让反射索引在类被修改时自动失效）
+class DynamicAdd(metaclass=IndexedMeta):
     pass
 
 # 动态添加类属性
@@ -162,25 +362,518 @@ print(f"动态类属性: {DynamicAdd.new_class_attr}")
 print(f"动态实例方法: {instance.instance_method()}")
 print(f"动态类方法: {DynamicAdd.class_method()}")
 print(f"动态静态方法: {DynamicAdd.static_method()}")
+print(f"动态添加后的反射索引: {reflection.methods(DynamicAdd)}")
+DynamicAdd.instance_method = lambda self: "替换后的实例方法"  # 同名替换也会使索引失效
+builds_before = reflection.builds
+print(f"替换后公有方法: {reflection.methods(DynamicAdd)}, 索引重建: {reflection.builds - builds_before} 次")
 
 
 print("\n------------装饰器高级用法------------")
 
+import asyncio
+import functools
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+class LatencyHistogram:
+    """HDR 风格的对数-线性延迟直方图（单位：纳秒）
+
+    每个 2 的幂区间再细分为 2**(SUB_BITS-1) 个子桶，相对误差不超过 1/64。
+    桶计数存放在预分配的定长列表中；总数、均值、最小值和最大值都从桶上推导，
+    记录一次只需一次位运算和一次列表自增。
+    """
+
+    SUB_BITS = 7
+    _HALF = 1 << (SUB_BITS - 1)
+    # 覆盖 64 位纳秒值所需的桶数
+    BUCKETS = (64 - SUB_BITS + 2) * _HALF
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+
+    @classmethod
+    def bucket_index(cls, value):
+        e = value.bit_length()
+        if e <= cls.SUB_BITS:
+            return value
+        shift = e - cls.SUB_BITS
+        return shift * cls._HALF + (value >> shift)
+
+    @classmethod
+    def bucket_lower(cls, index):
+        if index < 2 * cls._HALF:
+            return index
+        shift = index // cls._HALF - 1
+        return (index - shift * cls._HALF) << shift
+
+    @classmethod
+    def bucket_upper(cls, index):
+        """桶内最大值，用作分位数的保守估计"""
+        if index < 2 * cls._HALF:
+            return index
+        return cls.bucket_lower(index + 1) - 1
+
+    def record(self, value):
+        self.counts[self.bucket_index(value)] += 1
+
+    def _nonzero(self):
+        return [(idx, c) for idx, c in enumerate(self.counts) if c]
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def summary(self, *qs):
+        """一次遍历得到 (总数, 均值, 最小值, 最大值, 各分位数)，qs 取值 0~100"""
+        buckets = self._nonzero()
+        if not buckets:
+            return 0, 0, 0, 0, [0] * len(qs)
+        total = sum(c for _, c in buckets)
+        mean = sum((self.bucket_lower(i) + self.bucket_upper(i)) / 2 * c
+                   for i, c in buckets) / total
+        targets = sorted((q / 100 * total, n) for n, q in enumerate(qs))
+        result = [0] * len(qs)
+        seen = 0
+        t = 0
+        for idx, c in buckets:
+            seen += c
+            while t < len(targets) and seen >= targets[t][0]:
+                result[targets[t][1]] = self.bucket_upper(idx)
+                t += 1
+        lowest, highest = buckets[0][0], buckets[-1][0]
+        return total, mean, self.bucket_lower(lowest), self.bucket_upper(highest), result
+
+    def percentiles(self, *qs):
+        return self.summary(*qs)[4]
+
+    def reset(self):
+        # 原地清零，保持列表身份不变（埋点包装器持有它的引用）
+        self.counts[:] = [0] * self.BUCKETS
+
+
+# 小于 SMALL_LIMIT 纳秒的延迟直接查表得到桶号，埋点热路径上省掉位运算
+_SMALL_LIMIT = 1 << 12
+_SMALL_BUCKETS = tuple(LatencyHistogram.bucket_index(v) for v in range(_SMALL_LIMIT))
+
+
+class FunctionStats:
+    """单个函数的调用计数、采样率和延迟直方图
+
+    调用计数用 itertools.count：next() 是单个 C 层调用，多线程下不会丢计数，
+    也比加锁的 += 便宜。
+    """
+
+    __slots__ = ("name", "counter", "interval", "histogram")
+
+    def __init__(self, name, sample_rate=1.0):
+        self.name = name
+        self.counter = itertools.count()
+        self.histogram = LatencyHistogram()
+        self.set_sample_rate(sample_rate)
+
+    @property
+    def calls(self):
+        # count 对象不能只读当前值，它的 repr 是 "count(n)"
+        return int(repr(self.counter)[6:-1])
+
+    def reset_calls(self):
+        self.counter = itertools.count()
+
+    def set_sample_rate(self, rate):
+        if not 0 < rate <= 1:
+            raise ValueError(f"采样率必须在 (0, 1] 之间: {rate}")
+        # 用确定性的“每 N 次采 1 次”代替随机数，热路径上只做一次取模
+        self.interval = max(1, round(1 / rate))
+
+    @property
+    def sample_rate(self):
+        return 1 / self.interval
+
+    @property
+    def sampled(self):
+        return self.histogram.total
+
+    def snapshot(self):
+        sampled, mean, low, high, (p50, p99, p999) = self.histogram.summary(50, 99, 99.9)
+        return {
+            "calls": self.calls,
+            "sampled": sampled,
+            "sample_rate": self.sample_rate,
+            "mean_ns": mean,
+            "min_ns": low,
+            "max_ns": high,
+            "p50_ns": p50,
+            "p99_ns": p99,
+            "p999_ns": p999,
+        }
+
+
+class Instrumentation:
+    """函数延迟埋点注册表，提供运行时调整采样率和快照导出"""
+
+    # 默认采样率下每次调用允许的额外开销预算；全量采样要多读两次时钟，
+    # 在慢机器上会超出预算，只适合临时排查时用 set_sample_rate 调高
+    OVERHEAD_BUDGET_NS = 1000
+    DEFAULT_SAMPLE_RATE = 0.1
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def stats_for(self, name, sample_rate=None):
+        if sample_rate is None:
+            sample_rate = self.DEFAULT_SAMPLE_RATE
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = FunctionStats(name, sample_rate)
+            return stats
+
+    def set_sample_rate(self, name, rate):
+        """运行时修改某个函数的采样率"""
+        self._stats[name].set_sample_rate(rate)
+
+    def instrument(self, name=None, sample_rate=None):
+        """装饰器：统计调用次数，并按采样率记录 perf_counter_ns 延迟"""
+        def decorator(func):
+            stats = self.stats_for(name or func.__qualname__, sample_rate)
+            counts = stats.histogram.counts
+            clock = time.perf_counter_ns
+            sub_bits, half = LatencyHistogram.SUB_BITS, LatencyHistogram._HALF
+            small, small_limit = _SMALL_BUCKETS, _SMALL_LIMIT
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if next(stats.counter) % stats.interval:
+                    return func(*args, **kwargs)
+                start = clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    # 内联 LatencyHistogram.record，省掉一次方法调用；短延迟直接查表
+                    elapsed = clock() - start
+                    if elapsed < small_limit:
+                        counts[small[elapsed]] += 1
+                    else:
+                        e = elapsed.bit_length() - sub_bits
+                        counts[e * half + (elapsed >> e)] += 1
+
+            wrapper.stats = stats
+            return wrapper
+
+        return decorator
+
+    def snapshot(self):
+        """导出所有函数的统计快照（dict）"""
+        with self._lock:
+            items = list(self._stats.items())
+        return {name: stats.snapshot() for name, stats in items}
+
+    def export_json(self, indent=None):
+        import json
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=indent)
+
+    def reset(self):
+        with self._lock:
+            for stats in self._stats.values():
+                stats.reset_calls()
+                stats.histogram.reset()
+
+    def measure_overhead(self, iterations=100_000, sample_rate=None, repeat=5):
+        """测量装饰器带来的单次调用额外开销（纳秒，取多轮最小值）"""
+        import timeit
+
+        def noop():
+            return None
+
+        probe = Instrumentation().instrument("noop", sample_rate)(noop)
+        bare, wrapped = (
+            min(timeit.repeat(fn, number=iterations, repeat=repeat)) / iterations * 1e9
+            for fn in (noop, probe)
+        )
+        return wrapped - bare
+
+
+metrics = Instrumentation()
+
+
 def timer_decorator(func):
-    """计时装饰器"""
-    import time
-    
-    def wrapper(*args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        print(f"{func.__name__} 执行时间: {end - start:.4f}秒")
-        return result
-    
-    return wrapper
+    """计时装饰器：全量记录到全局 metrics 的延迟直方图，不再逐次打印"""
+    return metrics.instrument(sample_rate=1.0)(func)
+
+
+_MISSING = object()
+_KWARGS_MARK = object()
+_FAST_KEY_TYPES = {int, str}
+
+
+def _make_key(args, kwargs, typed=False):
+    """用可哈希元组构造缓存键，避免 str() 序列化的开销"""
+    key = args
+    if kwargs:
+        key += (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+    if typed:
+        key += tuple(type(v) for v in args)
+        if kwargs:
+            key += tuple(type(v) for v in kwargs.values())
+    elif len(key) == 1 and type(key[0]) in _FAST_KEY_TYPES:
+        # 单个 int/str 参数直接作为键，省去元组哈希
+        return key[0]
+    return key
+
+
+from threading import get_ident
+
+
+class _InFlight:
+    """等待同键计算结果的线程共用的记录，由第一个等待者在缓存锁内创建"""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Lock()
+        self.done.acquire()  # 由发起计算的线程在结束时释放
+        self.value = None
+        self.error = None
+
+
+class MemoCache:
+    """线程安全的 LRU + TTL 缓存引擎
+
+    命中路径不加锁：读 dict、调整 LRU 顺序都是单个 C 层操作，在 GIL 下是原子的。
+    未命中时用 dict.setdefault 原子地登记计算者，没有并发等待者时整个未命中路径
+    只在写入结果时加一次锁。命中次数按线程分别计数，不会在并发下丢失。
+
+    Args:
+        maxsize: 最多缓存的条目数，None 表示不限
+        ttl: 条目存活秒数，None 表示永不过期
+        max_bytes: 缓存值的总字节预算，None 表示不限
+        sizeof: 估算单个值字节数的函数
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_bytes=None, sizeof=sys.getsizeof):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # 不限容量时不会淘汰，不必维护 LRU 顺序，用普通 dict 即可
+        self._bounded = maxsize is not None or max_bytes is not None
+        self._data = OrderedDict() if self._bounded else {}  # key -> (value, expire_at, nbytes)
+        self._inflight = {}  # key -> 正在计算的线程 id
+        self._waiters = {}  # key -> _InFlight，只有出现并发等待者时才有
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = {}  # 线程 id -> 命中次数，每个线程只写自己的条目
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hits(self):
+        return sum(list(self._hits.values()))
+
+    def _fast_get(self, key):
+        """无锁命中检查；不存在或已过期时返回 _MISSING，交给加锁的慢路径处理"""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expire_at, _ = entry
+        if expire_at is not None and expire_at <= time.monotonic():
+            return _MISSING
+        if self._bounded:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:  # 刚被其他线程淘汰，值仍然有效
+                pass
+        hits, ident = self._hits, get_ident()
+        hits[ident] = hits.get(ident, 0) + 1
+        return value
+
+    def get(self, key, default=None):
+        """读取缓存，未命中或已过期时返回 default"""
+        value = self._fast_get(key)
+        if value is _MISSING:
+            with self._lock:
+                value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        """写入缓存，必要时按 LRU 淘汰"""
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key, compute, /, *args, **kwargs):
+        """命中直接返回；未命中时只让一个线程执行 compute(*args, **kwargs)，其余线程等待结果"""
+        value = self._fast_get(key)
+        if value is _MISSING:
+            value = self._compute(key, compute, args, kwargs)
+        return value
+
+    def _compute(self, key, compute, args, kwargs):
+        """未命中的慢路径：一个线程计算，其余线程等待它的结果"""
+        ident = get_ident()
+        inflight = self._inflight
+        owner = inflight.get(key)
+        if owner == ident:
+            # 同一线程递归计算同一个键：直接计算，不等待自己
+            return compute(*args, **kwargs)
+        if owner is None:
+            owner = inflight.setdefault(key, ident)
+        if owner != ident:
+            return self._wait(key, compute, args, kwargs)
+        # 登记之前结果可能刚被其他线程写入（已计为命中）
+        value = self._fast_get(key) if key in self._data else _MISSING
+        if value is not _MISSING:
+            self._finish(key, value, computed=False)
+            return value
+        try:
+            value = compute(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, error=e)
+            raise
+        self._finish(key, value)
+        return value
+
+    def _finish(self, key, value=_MISSING, error=None, computed=True):
+        """计算者收尾：写入结果、撤销登记并唤醒等待者，只加一次锁"""
+        # 每次未命中都会走到这里；显式 acquire/release 比 with 语句少一半开销
+        lock = self._lock
+        lock.acquire()
+        try:
+            if computed:
+                if error is None:
+                    self._store(key, value)
+                self.misses += 1
+            del self._inflight[key]
+            waiter = self._waiters.pop(key, None)
+        finally:
+            lock.release()
+        if waiter is not None:
+            waiter.value, waiter.error = value, error
+            waiter.done.release()
+
+    def _wait(self, key, compute, args, kwargs):
+        with self._lock:
+            if key not in self._inflight:
+                waiter = None  # 计算者已经结束，重新查一次
+            else:
+                waiter = self._waiters.get(key)
+                if waiter is None:
+                    waiter = self._waiters[key] = _InFlight()
+                self.coalesced += 1
+                self.misses += 1
+        if waiter is None:
+            return self.get_or_compute(key, compute, *args, **kwargs)
+        with waiter.done:
+            pass
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回命中/未命中/淘汰等统计"""
+        with self._lock:
+            hits = self.hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "coalesced": self.coalesced,
+                "size": len(self._data),
+                "bytes": self._bytes,
+            }
+
+    # 以下方法需在持有锁时调用
+    def _lookup(self, key):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return _MISSING
+        value, expire_at, nbytes = entry
+        if expire_at is not None and expire_at <= time.monotonic():
+            del self._data[key]
+            self._bytes -= nbytes
+            self.expirations += 1
+            self.misses += 1
+            return _MISSING
+        if self._bounded:
+            self._data.move_to_end(key)
+        hits, ident = self._hits, get_ident()
+        hits[ident] = hits.get(ident, 0) + 1
+        return value
+
+    def _store(self, key, value):
+        data = self._data
+        old = data.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+            if old[1] is not None and old[1] <= time.monotonic():
+                self.expirations += 1
+        if not self._bounded and self.ttl is None:
+            data[key] = (value, None, 0)  # 最常见的不限容量、不过期缓存：不估算大小也不淘汰
+            return
+        nbytes = self.sizeof(value) if self.max_bytes is not None else 0
+        expire_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        data[key] = (value, expire_at, nbytes)
+        self._bytes += nbytes
+        maxsize, max_bytes = self.maxsize, self.max_bytes
+        while data and (
+            (maxsize is not None and len(data) > maxsize)
+            or (max_bytes is not None and self._bytes > max_bytes)
+        ):
+            _, (_, _, evicted_bytes) = data.popitem(last=False)
+            self._bytes -= evicted_bytes
+            self.evictions += 1
+
+
+def memoize(maxsize=1024, ttl=None, max_bytes=None, typed=False):
+    """带 LRU/TTL 淘汰、并发合并和统计的缓存装饰器"""
+    def decorator(func):
+        cache = MemoCache(maxsize=maxsize, ttl=ttl, max_bytes=max_bytes)
+        fast_get, compute = cache._fast_get, cache._compute
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if kwargs or typed or len(args) != 1 or type(args[0]) not in _FAST_KEY_TYPES:
+                key = _make_key(args, kwargs, typed)
+            else:
+                key = args[0]  # 内联 _make_key 最常见的单个 int/str 参数分支
+            value = fast_get(key)
+            if value is _MISSING:
+                value = compute(key, func, args, kwargs)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_info = cache.stats
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
 
 def cache_decorator(func):
-    """缓存装饰器"""
+    """缓存装饰器（基于 MemoCache，默认最多缓存 1024 个结果）"""
+    return memoize()(func)
+
+
+def naive_cache_decorator(func):
+    """旧版缓存装饰器：字符串键、无上限、每次命中都打印，仅用于对比"""
     cache = {}
     
     def wrapper(*args, **kwargs):
@@ -197,11 +890,182 @@ def cache_decorator(func):
     
     return wrapper
 
-def retry_decorator(max_retries=3, delay=1):
-    """重试装饰器"""
+class CircuitOpenError(RuntimeError):
+    """熔断器打开时快速失败抛出的异常"""
+
+
+class CircuitBreaker:
+    """可在多个函数间共享的熔断器
+
+    连续失败 failure_threshold 次后打开，打开期间所有调用直接失败；
+    reset_timeout 秒后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """当前是否允许发起调用"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """调用以不计成败的方式结束（如被取消、抛出不重试的异常）：只归还探测名额，状态不变"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """重试预算：每次调用存入 ratio 个令牌，每次重试消耗 1 个
+
+    限制重试流量不超过正常流量的 ratio 倍，防止依赖故障时重试放大负载。
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def backoff_delay(attempt, delay, backoff=2.0, max_delay=30.0, jitter=True):
+    """指数退避；jitter=True 时使用 full jitter：在 [0, 上限] 内均匀取值"""
+    cap = min(max_delay, delay * backoff ** attempt)
+    return random.uniform(0, cap) if jitter else cap
+
+
+def retry_decorator(max_retries=3, delay=1, *, backoff=2.0, max_delay=30.0, jitter=True,
+                    retry_on=(Exception,), budget=None, breaker=None, on_retry=None):
+    """重试装饰器，同时支持同步函数和协程函数
+
+    Args:
+        max_retries: 最多尝试次数（含第一次）
+        delay: 第一次重试前的退避上限（秒），之后按 backoff 倍数增长
+        retry_on: 允许重试的异常类型，其余异常直接抛出
+        budget: 共享的 RetryBudget，预算耗尽时不再重试
+        breaker: 共享的 CircuitBreaker，打开时抛出 CircuitOpenError
+        on_retry: 回调 on_retry(attempt, exception, delay)，可用于日志
+    """
+    def decorator(func):
+        def before_attempt():
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(f"{func.__name__}: 熔断器已打开")
+
+        def after_failure(attempt, error):
+            """返回下一次重试前的等待秒数；不应再重试时返回 None"""
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt == max_retries - 1:
+                return None
+            if budget is not None and not budget.try_withdraw():
+                return None
+            wait = backoff_delay(attempt, delay, backoff, max_delay, jitter)
+            if on_retry is not None:
+                on_retry(attempt, error, wait)
+            return wait
+
+        def after_success():
+            if breaker is not None:
+                breaker.record_success()
+
+        def after_abort():
+            # 不在 retry_on 中的异常和 CancelledError 等 BaseException 不算依赖故障，
+            # 但半开状态的探测名额必须归还，否则熔断器会永远拒绝调用
+            if breaker is not None:
+                breaker.release()
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if budget is not None:
+                    budget.deposit()
+                for attempt in range(max_retries):
+                    before_attempt()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except retry_on as e:
+                        wait = after_failure(attempt, e)
+                        if wait is None:
+                            raise
+                        await asyncio.sleep(wait)
+                    except BaseException:
+                        after_abort()
+                        raise
+                    else:
+                        after_success()
+                        return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if budget is not None:
+                budget.deposit()
+            for attempt in range(max_retries):
+                before_attempt()
+                try:
+                    result = func(*args, **kwargs)
+                except retry_on as e:
+                    wait = after_failure(attempt, e)
+                    if wait is None:
+                        raise
+                    time.sleep(wait)
+                except BaseException:
+                    after_abort()
+                    raise
+                else:
+                    after_success()
+                    return result
+
+        return wrapper
+    return decorator
+
+
+def blocking_retry_decorator(max_retries=3, delay=1):
+    """旧版重试装饰器：固定间隔、阻塞线程，仅用于对比"""
     def decorator(func):
         import time
         
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             for attempt in range(max_retries):
                 try:
@@ -216,18 +1080,27 @@ def retry_decorator(max_retries=3, delay=1):
     return decorator
 
 # 装饰器组合使用
+def fibonacci_pair(n):
+    """快速倍增求 (F(n), F(n+1))：O(log n)，不递归（完整引擎见 2.生成器.py）"""
+    a, b = 0, 1
+    for bit in bin(n)[2:]:
+        c = a * (2 * b - a)
+        d = a * a + b * b
+        a, b = (d, c + d) if bit == "1" else (c, d)
+    return a, b
+
 @timer_decorator
 @cache_decorator
 def fibonacci(n):
-    """斐波那契数列（带缓存）"""
-    if n <= 1:
-        return n
-    return fibonacci(n - 1) + fibonacci(n - 2)
+    """斐波那契数列（带缓存）；不再递归，计时和缓存每次调用只触发一次"""
+    return fibonacci_pair(n)[0]
+
+def print_retry(attempt, error, wait):
+    print(f"第{attempt + 1}次尝试失败，{wait:.2f}秒后重试: {error}")
 
-@retry_decorator(max_retries=3, delay=0.5)
+@retry_decorator(max_retries=3, delay=0.5, on_retry=print_retry)
 def unreliable_function():
     """不可靠的函数（用于演示重试）"""
-    import random
     if random.random() < 0.7:  # 70% 的概率失败
         raise ValueError("随机失败")
     return "成功!"
@@ -236,6 +1109,7 @@ def unreliable_function():
 print("斐波那契数列计算:")
 print(f"fibonacci(10): {fibonacci(10)}")
 print(f"fibonacci(10): {fibonacci(10)}")  # 使用缓存
+print(f"fibonacci(5000) 的位数: {len(str(fibonacci(5000)))}")  # 远超原先的递归深度限制
 
 print("\n重试机制测试:")
 try:
@@ -244,11 +1118,273 @@ try:
 except Exception as e:
     print(f"最终失败: {e}")
 
+shared_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+
+@retry_decorator(max_retries=2, delay=0.01, retry_on=(ConnectionError,), breaker=shared_breaker)
+async def flaky_dependency():
+    raise ConnectionError("依赖不可用")
+
+async def breaker_demo():
+    for i in range(4):
+        try:
+            await flaky_dependency()
+        except (ConnectionError, CircuitOpenError) as e:
+            print(f"  第{i + 1}次调用: {type(e).__name__} ({shared_breaker.state})")
+
+print("共享熔断器（异步）:")
+asyncio.run(breaker_demo())
+
+
+def retry_load_test(calls=200, workers=8, io_latency=0.005, delay=0.02):
+    """基于 unreliable_function 的负载测试：阻塞重试(线程池) vs 异步重试"""
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    from contextlib import redirect_stdout
+
+    flaky = unreliable_function.__wrapped__
+    attempts = 6  # 70% 失败率下保证大多数调用最终成功
+
+    @blocking_retry_decorator(max_retries=attempts, delay=delay)
+    def blocking_call():
+        time.sleep(io_latency)  # 模拟网络 I/O
+        return flaky()
+
+    @retry_decorator(max_retries=attempts, delay=delay, retry_on=(ValueError,))
+    async def async_call():
+        await asyncio.sleep(io_latency)
+        return flaky()
+
+    def run_blocking():
+        def safe_call(_):
+            try:
+                return blocking_call()
+            except ValueError:
+                return None
+
+        with redirect_stdout(io.StringIO()), ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(safe_call, range(calls)))
+
+    async def run_async():
+        return await asyncio.gather(*(async_call() for _ in range(calls)),
+                                    return_exceptions=True)
+
+    for label, runner in (("阻塞重试 + 线程池", run_blocking),
+                          ("异步重试 + 退避抖动", lambda: asyncio.run(run_async()))):
+        start = time.perf_counter()
+        results = runner()
+        elapsed = time.perf_counter() - start
+        ok = sum(r == "成功!" for r in results)
+        print(f"  {label}: {calls} 次调用 {elapsed:.2f}s, "
+              f"成功 {ok}, 吞吐 {calls / elapsed:.0f} 次/秒")
+
+print("重试负载测试:")
+retry_load_test()
+
+print("\n缓存引擎测试:")
+print(f"fibonacci 缓存统计: {fibonacci.__wrapped__.cache_info()}")
+
+@memoize(maxsize=2, ttl=0.05)
+def slow_square(x):
+    return x * x
+
+for x in (1, 2, 1, 3):  # 容量为 2，访问 3 时淘汰最久未用的 2
+    slow_square(x)
+time.sleep(0.06)
+slow_square(3)  # 已过期，重新计算
+print(f"LRU/TTL 统计: {slow_square.cache_info()}")
+
+@memoize(maxsize=16)
+def slow_lookup(key):
+    time.sleep(0.05)
+    return key.upper()
+
+threads = [threading.Thread(target=slow_lookup, args=("k",)) for _ in range(8)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+print(f"8 个线程并发未命中同一个键: {slow_lookup.cache_info()}")
+
+print("\n延迟埋点测试:")
+print(f"fibonacci 埋点快照: {metrics.snapshot()['fibonacci']}")
+
+@metrics.instrument(sample_rate=0.1)
+def hot_path(x):
+    return x * 2
+
+for i in range(1000):
+    hot_path(i)
+metrics.set_sample_rate("hot_path", 1.0)  # 运行时调高采样率
+for i in range(1000):
+    hot_path(i)
+print(f"hot_path 调用/采样: {hot_path.stats.calls}/{hot_path.stats.sampled}")
+
+@metrics.instrument(sample_rate=1.0)
+def threaded_path():
+    return None
+
+def call_many(n=20_000):
+    for _ in range(n):
+        threaded_path()
+
+workers = [threading.Thread(target=call_many) for _ in range(4)]
+for t in workers:
+    t.start()
+for t in workers:
+    t.join()
+print(f"4 个线程各调用 20000 次，计数: {threaded_path.stats.calls}")
+print(f"JSON 导出: {metrics.export_json()[:80]}...")
+
+for rate in (1.0, Instrumentation.DEFAULT_SAMPLE_RATE, 0.01):
+    overhead = metrics.measure_overhead(sample_rate=rate)
+    print(f"采样率 {rate}: 每次调用额外开销 {overhead:.0f}ns "
+          f"(预算 {Instrumentation.OVERHEAD_BUDGET_NS}ns, "
+          f"{'达标' if overhead <= Instrumentation.OVERHEAD_BUDGET_NS else '超出'})")
+
+
+def benchmark_cache(n=200, repeat=2000):
+    """对比字符串键字典、MemoCache 和 functools.lru_cache 在 fibonacci 上的耗时
+
+    基线是去掉打印的旧版字符串键缓存，比较的是键构造和查找本身，而不是 I/O。
+    """
+    def str_key_cache(func):
+        cache = {}
+
+        def wrapper(*args, **kwargs):
+            key = str(args) + str(sorted(kwargs.items()))
+            if key not in cache:
+                cache[key] = func(*args, **kwargs)
+            return cache[key]
+        return wrapper
+
+    def make_fib(decorator):
+        @decorator
+        def fib(k):
+            if k <= 1:
+                return k
+            return fib(k - 1) + fib(k - 2)
+        return fib
+
+    results = {}
+    for label, decorator in (("字符串键字典(不打印)", lambda: str_key_cache),
+                             ("memoize", lambda: memoize(maxsize=None)),
+                             ("memoize(maxsize=1024)", lambda: memoize(maxsize=1024)),
+                             ("functools.lru_cache", lambda: functools.lru_cache(maxsize=None))):
+        # 首次计算取 5 个全新缓存中最快的一次，减少单次计时的抖动
+        cold = float("inf")
+        for _ in range(5):
+            fib = make_fib(decorator())
+            start = time.perf_counter()
+            fib(n)
+            cold = min(cold, time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fib(n)
+        hot = time.perf_counter() - start
+        results[label] = (cold, hot / repeat)
+        print(f"{label:>22}: 首次 fib({n}) {cold * 1e3:.3f}ms, "
+              f"命中 {hot / repeat * 1e6:.3f}µs/次")
+    print("  lru_cache 是 C 实现，只要 LRU 时优先用它；MemoCache 多出 TTL、字节预算和并发合并")
+    return results
+
+benchmark_cache()
+
 
 print("\n------------属性描述符进阶------------")
 
+import re
+import types
+
 class ValidatedAttribute:
-    """带验证的属性描述符"""
+    """带验证的属性描述符
+
+    只定义 __set__ 不定义 __get__：赋值时验证后写入实例 __dict__ 中的同名条目，
+    读取时由解释器直接查实例字典，没有 Python 级的 __get__ 调用。
+    没有 __get__ 时未赋值的字段会读到描述符本身，所以 __set_name__ 会给所属类
+    装上一个 __new__，创建实例时先写入所有字段的默认值，不依赖各个构造函数自觉去写。
+    值随实例一起回收，不会泄漏。
+    """
+    
+    def __init__(self, name=None, validator=None, default=None):
+        self.name = name
+        self.validator = validator
+        self.default = default
+        self.attr = name
+    
+    def __set_name__(self, owner, name):
+        self.attr = name
+        if self.name is None:
+            self.name = name
+        # 在类上登记所有验证字段，供 __new__ 写默认值和 validate_many 批量处理
+        fields = dict(getattr(owner, "_validated_fields", {}))
+        fields[name] = self
+        owner._validated_fields = fields
+        owner._validated_defaults = {attr: field.default for attr, field in fields.items()}
+        if not getattr(owner, "_fills_validated_defaults", False):
+            _install_default_new(owner)
+    
+    def __set__(self, instance, value):
+        if not self.validator(value):
+            raise ValueError(f"{self.name} 验证失败: {value}")
+        instance.__dict__[self.attr] = value
+    
+    def __delete__(self, instance):
+        # 删除后恢复默认值，保持“读取总能拿到值”
+        instance.__dict__[self.attr] = self.default
+    
+    def store(self, instance, value):
+        """跳过验证直接写入实例存储"""
+        instance.__dict__[self.attr] = value
+
+
+def _install_default_new(owner):
+    """给使用 ValidatedAttribute 的类装上写默认值的 __new__（子类继承，按各自的字段表写入）"""
+    base_new = owner.__new__
+
+    def __new__(cls, *args, **kwargs):
+        if base_new is object.__new__:
+            instance = base_new(cls)
+        else:
+            instance = base_new(cls, *args, **kwargs)
+        instance.__dict__.update(cls._validated_defaults)
+        return instance
+
+    owner.__new__ = staticmethod(__new__)
+    owner._fills_validated_defaults = True
+
+
+def validate_many(cls, rows):
+    """批量创建实例：按字段整列验证后直接写入存储，避免逐个属性走 __set__
+
+    Args:
+        cls: 使用 ValidatedAttribute 的类
+        rows: 字典序列，每个字典对应一个实例的字段值
+
+    Raises:
+        ValueError: 任一字段验证失败时，指明行号和字段
+    """
+    fields = cls._validated_fields
+    rows = rows if isinstance(rows, list) else list(rows)
+    for attr, field in fields.items():
+        validator = field.validator
+        for i, row in enumerate(rows):
+            if attr in row and not validator(row[attr]):
+                raise ValueError(f"第{i}行 {field.name} 验证失败: {row[attr]}")
+    stores = [(attr, field.store) for attr, field in fields.items()]
+    new = cls.__new__
+    instances = []
+    append = instances.append
+    for row in rows:
+        obj = new(cls)  # __new__ 已写好默认值
+        for attr, store in stores:
+            if attr in row:
+                store(obj, row[attr])
+        append(obj)
+    return instances
+
+
+class IdKeyedValidatedAttribute:
+    """旧版描述符：按 id(instance) 存在类级字典中，实例销毁后不会清理，仅用于对比"""
     
     def __init__(self, name, validator, default=None):
         self.name = name
@@ -284,16 +1420,16 @@ def validate_age_range(min_age=0, max_age=150):
 
 def validate_email_format():
     """邮箱格式验证器"""
+    pattern = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
     def validator(value):
-        import re
         if not isinstance(value, str):
             return False
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, value) is not None
+        return pattern.match(value) is not None
     return validator
 
 class UserProfile:
-    """用户档案类，使用描述符验证"""
+    """用户档案类，使用描述符验证（值存放在实例 __dict__ 中）"""
     
     username = ValidatedAttribute('username', validate_string_length(3, 20))
     email = ValidatedAttribute('email', validate_email_format())
@@ -329,35 +1465,313 @@ try:
 except ValueError as e:
     print(f"验证错误: {e}")
 
+profiles = validate_many(UserProfile, [
+    {"username": "alice", "email": "alice@example.com", "age": 30},
+    {"username": "bob", "email": "bob@example.com", "age": 41, "bio": "hi"},
+])
+print(f"批量创建: {[(p.username, p.age, p.bio) for p in profiles]}")
+
+class Labeled:
+    """没有自定义构造函数，也不写任何字段"""
+    label = ValidatedAttribute(validator=validate_string_length(1, 10), default="未命名")
+
+class PinnedLabeled(Labeled):
+    pinned = ValidatedAttribute(validator=lambda v: isinstance(v, bool), default=False)
+
+partial = UserProfile(username="dave")
+assert partial.bio is None and partial.age is None, "未赋值的字段应读到默认值"
+assert Labeled().label == "未命名" and PinnedLabeled().pinned is False
+del partial.username
+print(f"未赋值字段: bio={partial.bio!r}, 删除后 username={partial.username!r}, "
+      f"子类默认值: {PinnedLabeled().label!r}/{PinnedLabeled().pinned!r}")
+try:
+    validate_many(UserProfile, [{"username": "carol", "age": 200}])
+except ValueError as e:
+    print(f"批量验证错误: {e}")
+
+
+def benchmark_descriptors(n=20_000, repeat=5):
+    """对比旧版 id 键描述符与实例字典描述符的读写吞吐和内存占用
+
+    读取不再经过 Python 级 __get__；写入两者都要跑一次验证函数，差距主要在读取上。
+    """
+    import timeit
+    import tracemalloc
+
+    class LegacyUserProfile:
+        username = IdKeyedValidatedAttribute('username', validate_string_length(3, 20))
+        email = IdKeyedValidatedAttribute('email', validate_email_format())
+        age = IdKeyedValidatedAttribute('age', validate_age_range(0, 120))
+        bio = IdKeyedValidatedAttribute('bio', validate_string_length(0, 500))
+
+        def __init__(self, **kwargs):
+            for key, value in kwargs.items():
+                if hasattr(self, key):
+                    setattr(self, key, value)
+
+    row = {"username": "testuser", "email": "test@example.com", "age": 25, "bio": "bio"}
+    for cls in (LegacyUserProfile, UserProfile):
+        obj = cls(**row)
+        get_time = min(timeit.repeat(lambda: obj.age, number=n, repeat=repeat)) / n
+        set_time = min(timeit.repeat(lambda: setattr(obj, "age", 30), number=n, repeat=repeat)) / n
+        tracemalloc.start()
+        objs = [cls(**row) for _ in range(n)]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del objs
+        print(f"  {cls.__name__:>17}: get {get_time * 1e9:.0f}ns, set {set_time * 1e9:.0f}ns, "
+              f"{memory / n:.0f} 字节/实例")
+    rows = [row] * n
+    for label, build in (("逐个构造", lambda: [UserProfile(**r) for r in rows]),
+                         ("validate_many", lambda: validate_many(UserProfile, rows))):
+        elapsed = min(timeit.repeat(build, number=1, repeat=3))
+        print(f"  {label}: {elapsed / n * 1e9:.0f}ns/实例")
+
+benchmark_descriptors()
+
 
 print("\n------------元编程：函数工厂------------")
 
+import array
+import operator
+from collections.abc import Sequence
+from itertools import repeat
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖，缺失时走纯 Python 路径
+    np = None
+
+# 操作名 -> (运算符源码, 标量函数, NumPy ufunc 名)
+_OPERATIONS = {
+    'add': ('+', operator.add, 'add'),
+    'multiply': ('*', operator.mul, 'multiply'),
+    'power': ('**', operator.pow, 'power'),
+}
+
+
+def _is_sequence(value):
+    """只把真正的序列（list/tuple/array.array/ndarray 等）当作批量操作数，字符串和其余对象都按标量处理"""
+    if isinstance(value, (str, bytes)):
+        return False
+    if isinstance(value, (Sequence, array.array)):
+        return True
+    return np is not None and isinstance(value, np.ndarray) and value.ndim > 0
+
+
+def _as_python(value):
+    """NumPy 标量转成 Python 数，避免纯 Python 路径上出现定长整数的溢出回绕"""
+    return value.item() if np is not None and isinstance(value, np.generic) else value
+
+
+def _use_numpy(*values):
+    return np is not None and any(isinstance(v, (np.ndarray, array.array)) for v in values)
+
+
+# NumPy 整数路径用 int64 计算，结果位数估计不超过这个值时才能保证不溢出
+_INT_SAFE_BITS = 62
+
+
+def _max_bits(values):
+    return max(abs(int(values.min())), abs(int(values.max()))).bit_length() if values.size else 0
+
+
+def _numpy_dtype(operations, arrays):
+    """决定 NumPy 路径的计算 dtype
+
+    浮点 / 复数直接按结果类型计算；整数按每一步的结果位数上界判断能否用 int64 精确计算。
+    可能溢出、出现负指数（纯 Python 路径会得到浮点数）或遇到 object 等其他类型时
+    返回 None，交给精确的纯 Python 路径，两条路径的结果保持一致。
+    """
+    kinds = {a.dtype.kind for a in arrays}
+    if not kinds <= set("biufc"):
+        return None
+    if kinds & set("fc"):
+        return np.result_type(*arrays)
+    bits = _max_bits(arrays[0])
+    for operation, operand in zip(operations, arrays[1:]):
+        operand_bits = _max_bits(operand)
+        if operation == 'add':
+            bits = max(bits, operand_bits) + 1
+        elif operation == 'multiply':
+            bits += operand_bits
+        else:
+            if operand.size and operand.min() < 0:
+                return None
+            bits *= int(operand.max()) if operand.size else 0
+        if bits > _INT_SAFE_BITS:
+            return None
+    return np.dtype(np.int64)
+
+
+def _to_array(result, like):
+    """把纯 Python 结果转换回 array.array
+
+    类型码放不下时依次退回 'q'（整数）和 'd'（能精确表示的 int/float）；
+    仍放不下（超大整数、Decimal 等）就保留列表，不做有损转换。
+    """
+    for typecode in (like.typecode, 'q'):
+        try:
+            return array.array(typecode, result)
+        except (TypeError, OverflowError):
+            pass
+    if all(type(v) is float or (type(v) is int and -2**53 <= v <= 2**53) for v in result):
+        return array.array('d', result)
+    return result
+
+
+def _restore_type(result, inputs):
+    """纯 Python 路径的结果按输入类型返回：ndarray 输入得到 ndarray（大整数为 object dtype），
+    array.array 输入得到 array.array，其余为列表"""
+    if np is not None and any(isinstance(v, np.ndarray) for v in inputs):
+        return np.array(result)
+    like = next((v for v in inputs if isinstance(v, array.array)), None)
+    return _to_array(result, like) if like is not None else result
+
+
+def _from_numpy(result, inputs):
+    """NumPy 计算结果按输入类型返回：有 array.array 输入时转回 array.array，规则与 _to_array 相同"""
+    if any(isinstance(v, np.ndarray) for v in inputs):
+        return result
+    like = next(v for v in inputs if isinstance(v, array.array))
+    target = np.dtype(like.typecode)
+    if result.dtype.kind in "biu" and target.kind in "iu":
+        info = np.iinfo(target)
+        fits = not result.size or (info.min <= result.min() and result.max() <= info.max)
+        typecode = like.typecode if fits else 'q'
+    elif result.dtype.kind == 'f' and target.kind == 'f':
+        typecode = like.typecode
+    else:
+        typecode = result.dtype.char if result.dtype.char in array.typecodes else 'd'
+    return array.array(typecode, result.astype(typecode, copy=False).tobytes())
+
+
+def _check_lengths(values):
+    lengths = {len(v) for v in values if _is_sequence(v)}
+    if len(lengths) > 1:
+        raise ValueError(f"序列长度不一致: {sorted(lengths)}")
+
+
+def _make_batch(operation):
+    """生成逐元素批量版本：一次调用处理整个序列，标量自动广播"""
+    _, scalar_op, ufunc_name = _OPERATIONS[operation]
+
+    def batch(a, b):
+        if not _is_sequence(a) and not _is_sequence(b):
+            return scalar_op(a, b)
+        if _use_numpy(a, b):
+            arrays = [np.asarray(a), np.asarray(b)]
+            dtype = _numpy_dtype((operation,), arrays)
+            if dtype is not None:
+                left, right = (x.astype(dtype, copy=False) for x in arrays)
+                return _from_numpy(getattr(np, ufunc_name)(left, right), (a, b))
+        _check_lengths((a, b))
+        left = a if _is_sequence(a) else repeat(_as_python(a))
+        right = b if _is_sequence(b) else repeat(_as_python(b))
+        if np is not None:
+            # 走到这里的 ndarray / array.array 也逐个转成 Python 数，保证精确
+            left = map(_as_python, left) if isinstance(left, np.ndarray) else left
+            right = map(_as_python, right) if isinstance(right, np.ndarray) else right
+        result = list(map(scalar_op, left, right))
+        return _restore_type(result, (a, b))
+
+    batch.__name__ = f"{operation}_batch"
+    batch.__doc__ = f"{operation} 的批量版本"
+    return batch
+
+
+class FusedExpression:
+    """把多步逐元素运算融合为一次遍历，步骤之间不产生中间列表
+
+    纯 Python 路径会把所有步骤编译成一个 lambda 后只 map 一次；
+    NumPy 路径先分配一个输出数组，之后每一步都用 ufunc 的 out= 原地计算。
+    """
+
+    def __init__(self, steps=()):
+        for operation, _ in steps:
+            if operation not in _OPERATIONS:
+                raise ValueError(f"不支持的操作: {operation}")
+        self.steps = tuple(steps)
+        self._kernel = None
+
+    def then(self, operation, operand):
+        """追加一步运算，返回新的表达式"""
+        return FusedExpression(self.steps + ((operation, operand),))
+
+    def _compile(self):
+        """编译成单个逐元素函数，序列操作数作为额外的 map 参数"""
+        expr = "x"
+        params = ["x"]
+        constants = {}
+        for i, (operation, operand) in enumerate(self.steps):
+            name = f"c{i}"
+            if _is_sequence(operand):
+                params.append(name)
+            else:
+                constants[name] = _as_python(operand)
+            expr = f"({expr} {_OPERATIONS[operation][0]} {name})"
+        self._kernel = eval(f"lambda {', '.join(params)}: {expr}", constants)
+
+    def __call__(self, values):
+        operands = [operand for _, operand in self.steps]
+        if _use_numpy(values, *operands):
+            arrays = [np.asarray(v) for v in (values, *operands)]
+            dtype = _numpy_dtype([operation for operation, _ in self.steps], arrays)
+            if dtype is not None:
+                out = np.array(arrays[0], dtype=dtype)
+                for (operation, _), operand in zip(self.steps, arrays[1:]):
+                    getattr(np, _OPERATIONS[operation][2])(out, operand, out=out)
+                return _from_numpy(out, (values, *operands))
+        _check_lengths((values, *operands))
+        if self._kernel is None:
+            self._compile()
+        columns = [values, *(o for o in operands if _is_sequence(o))]
+        if np is not None:
+            columns = [map(_as_python, c) if isinstance(c, np.ndarray) else c for c in columns]
+        return _restore_type(list(map(self._kernel, *columns)), (values, *operands))
+
+    def __repr__(self):
+        expr = "x"
+        for operation, operand in self.steps:
+            shown = "seq" if _is_sequence(operand) else repr(operand)
+            expr = f"({expr} {_OPERATIONS[operation][0]} {shown})"
+        return f"FusedExpression({expr})"
+
+
 def create_operation_function(operation):
-    """创建数学运算函数的工厂"""
+    """创建数学运算函数的工厂
+
+    返回的标量函数附带 batch(a, b) 批量版本，以及 fuse(operand)
+    用于开始一个融合表达式。
+    """
     
     if operation == 'add':
         def add(a, b):
             return a + b
         add.__name__ = 'add'
         add.__doc__ = '加法函数'
-        return add
+        func = add
     
     elif operation == 'multiply':
         def multiply(a, b):
             return a * b
         multiply.__name__ = 'multiply'
         multiply.__doc__ = '乘法函数'
-        return multiply
+        func = multiply
     
     elif operation == 'power':
         def power(base, exponent):
             return base ** exponent
         power.__name__ = 'power'
         power.__doc__ = '幂运算函数'
-        return power
+        func = power
     
     else:
         raise ValueError(f"不支持的操作: {operation}")
+    
+    func.batch = _make_batch(operation)
+    func.fuse = lambda operand: FusedExpression(((operation, operand),))
+    return func
 
 # 函数工厂使用
 add_func = create_operation_function('add')
@@ -374,32 +1788,111 @@ functions = {op: create_operation_function(op) for op in operations}
 
 print(f"函数字典: {[func.__name__ for func in functions.values()]}")
 
+# 批量与融合
+print(f"批量加法: {add_func.batch([1, 2, 3], 10)}")
+print(f"批量乘法(array): {multiply_func.batch(array.array('i', [1, 2, 3]), [4, 5, 6])}")
+print(f"标量也可以直接传给 batch: {add_func.batch(1, 2)}")
+# int32 输入的乘积超出 int64 安全范围时退回纯 Python 路径，结果与列表输入一致
+print(f"不会溢出回绕: {multiply_func.batch(array.array('i', [100000]), array.array('i', [100000]))}")
+print(f"负指数得到浮点数: {power_func.batch(array.array('i', [2, 4]), -1)}")
+expression = add_func.fuse(1).then('multiply', 2).then('power', 2)
+print(f"{expression}: {expression([0, 1, 2, 3])}")
+
+
+def benchmark_operations(n=200_000):
+    """对比逐元素调用标量函数、batch 分步计算和融合表达式"""
+    import timeit
+
+    xs = list(range(n))
+    cases = {
+        "标量函数循环": lambda: [power_func(multiply_func(add_func(x, 1), 2), 2) for x in xs],
+        "batch 分步": lambda: power_func.batch(multiply_func.batch(add_func.batch(xs, 1), 2), 2),
+        "融合表达式": lambda: expression(xs),
+    }
+    if np is not None:
+        arr = np.arange(n, dtype=np.float64)
+        cases["融合表达式(NumPy)"] = lambda: expression(arr)
+    else:
+        print("  未安装 NumPy，跳过向量化路径")
+    for label, fn in cases.items():
+        elapsed = min(timeit.repeat(fn, number=1, repeat=3))
+        print(f"  {label}: {elapsed * 1e3:.1f}ms ({n / elapsed / 1e6:.2f}M 元素/秒)")
+
+benchmark_operations()
+
 
 print("\n------------类方法和实例方法的动态切换------------")
 
+class DispatchTable:
+    """模式到处理函数的分派表：注册一次，切换模式时解析，调用时不再查找"""
+    
+    def __init__(self):
+        self._handlers = {}
+    
+    def register(self, mode, handler=None):
+        """注册处理函数，也可作为装饰器使用"""
+        if handler is None:
+            return lambda func: self.register(mode, func)
+        self._handlers[mode] = handler
+        return handler
+    
+    def resolve(self, mode, instance=None):
+        """返回 mode 对应的可调用对象；传入 instance 时返回绑定方法"""
+        try:
+            handler = self._handlers[mode]
+        except KeyError:
+            raise ValueError(f"未知的模式: {mode}") from None
+        return handler if instance is None else handler.__get__(instance, type(instance))
+    
+    def __contains__(self, mode):
+        return mode in self._handlers
+    
+    def __len__(self):
+        return len(self._handlers)
+    
+    def modes(self):
+        return list(self._handlers)
+
 class MethodSwitcher:
-    """方法切换器"""
+    """方法切换器：设置 mode 时解析出对应的处理函数
+
+    实例上只保存未绑定的函数，调用时再传入 self；若保存绑定方法，
+    实例 → 绑定方法 → 实例会形成引用环，只能等循环垃圾回收释放。
+    """
+    
+    handlers = DispatchTable()
     
     def __init__(self, mode='normal'):
         self.mode = mode
     
+    @property
+    def mode(self):
+        return self._mode
+    
+    @mode.setter
+    def mode(self, mode):
+        # 模式切换时解析一次，之后 process 只需一次属性读取和一次函数调用
+        self._handler = self.handlers.resolve(mode)
+        self._mode = mode
+    
     def process(self, data):
-        """根据模式选择不同的处理方法"""
-        if self.mode == 'normal':
-            return self._normal_process(data)
-        elif self.mode == 'reverse':
-            return self._reverse_process(data)
-        elif self.mode == 'uppercase':
-            return self._uppercase_process(data)
-        else:
-            raise ValueError(f"未知的模式: {self.mode}")
+        """按当前模式处理数据"""
+        return self._handler(self, data)
+    
+    def process_many(self, items):
+        """批量处理：整批只取一次处理函数"""
+        handler = self._handler
+        return [handler(self, item) for item in items]
     
+    @handlers.register('normal')
     def _normal_process(self, data):
         return f"正常处理: {data}"
     
+    @handlers.register('reverse')
     def _reverse_process(self, data):
         return f"反转处理: {data[::-1]}"
     
+    @handlers.register('uppercase')
     def _uppercase_process(self, data):
         return f"大写处理: {data.upper()}"
 
@@ -413,12 +1906,21 @@ class DynamicMethod:
         self.methods[name] = method
         setattr(self, name, method)
     
+    def resolve(self, method_name):
+        """取出已注册的方法，热循环中可先解析再反复调用"""
+        try:
+            return self.methods[method_name]
+        except KeyError:
+            raise ValueError(f"方法 {method_name} 不存在") from None
+    
     def execute_method(self, method_name, *args, **kwargs):
-        """执行指定方法"""
-        if method_name in self.methods:
-            return self.methods[method_name](*args, **kwargs)
-        else:
-            raise ValueError(f"方法 {method_name} 不存在")
+        """执行指定方法（一次字典查找）"""
+        return self.resolve(method_name)(*args, **kwargs)
+    
+    def execute_many(self, method_name, items):
+        """对一批参数元组执行同一个方法，只解析一次"""
+        method = self.resolve(method_name)
+        return [method(*args) for args in items]
 
 # 测试动态方法
 switcher = MethodSwitcher('reverse')
@@ -434,4 +1936,64 @@ dynamic.register_method('greet', lambda name: f"你好, {name}!")
 dynamic.register_method('calculate', lambda a, b: a + b)
 
 print(f"动态问候: {dynamic.execute_method('greet', '张三')}")
-print(f"动态计算: {dynamic.execute_method('calculate', 10, 20)}")
\ No newline at end of file
+print(f"动态计算: {dynamic.execute_method('calculate', 10, 20)}")
+print(f"批量执行: {dynamic.execute_many('calculate', [(1, 2), (3, 4)])}")
+print(f"批量处理: {switcher.process_many(['ab', 'cd'])}")
+
+probe = MethodSwitcher('reverse')
+probe_ref = weakref.ref(probe)
+del probe  # 没有引用环，引用计数归零即释放，不需要等 gc
+print(f"切换器无引用环: {probe_ref() is None}")
+
+
+def benchmark_dispatch(mode_counts=(3, 30, 300), n=20_000, repeat=3):
+    """对比 if/elif 链、逐次字典查找、预解析绑定方法和批量处理的分派耗时"""
+    import timeit
+
+    for count in mode_counts:
+        modes = [f"mode{i}" for i in range(count)]
+        chain = "".join(
+            f"        {'if' if i == 0 else 'elif'} self.mode == {m!r}:\n"
+            f"            return self._handle(data)\n"
+            for i, m in enumerate(modes)
+        )
+        namespace = {}
+        exec(
+            "class ChainSwitcher:\n"
+            "    def __init__(self, mode):\n"
+            "        self.mode = mode\n"
+            "    def _handle(self, data):\n"
+            "        return data\n"
+            "    def process(self, data):\n"
+            f"{chain}"
+            "        raise ValueError(self.mode)\n",
+            namespace,
+        )
+        chained = namespace["ChainSwitcher"](modes[-1])  # 最坏情况：最后一个分支
+
+        class TableSwitcher(MethodSwitcher):
+            handlers = DispatchTable()
+
+        for m in modes:
+            TableSwitcher.handlers.register(m, lambda self, data: data)
+        table = TableSwitcher(modes[-1])
+
+        lookup = DynamicMethod()
+        for m in modes:
+            lookup.register_method(m, lambda data: data)
+        legacy_lookup = lambda data: lookup.methods[modes[-1]](data) if modes[-1] in lookup.methods else None
+
+        items = list(range(n))
+        results = {
+            "if/elif 链": lambda: [chained.process(x) for x in items],
+            "in + 字典查找": lambda: [legacy_lookup(x) for x in items],
+            "预解析处理函数": lambda: [table.process(x) for x in items],
+            "process_many": lambda: table.process_many(items),
+        }
+        timings = ", ".join(
+            f"{label} {min(timeit.repeat(fn, number=1, repeat=repeat)) / n * 1e9:.0f}ns"
+            for label, fn in results.items()
+        )
+        print(f"  {count:>3} 个模式: {timings}")
+
+benchmark_dispatch()
@@ -0,0 +1,59 @@
+"""3.1.特殊方法.py 和 3.4.反射和动态.py 共用的记录类代码生成
+
+脚本文件名以数字开头不能互相 import，公共部分放在这个模块里。
+"""
+
+import keyword
+
+# 生成的方法里会用到的名字，不能再作字段名
+RESERVED_FIELDS = frozenset({"self", "other", "_fields"})
+
+
+def check_field_names(fields):
+    """校验字段名能安全地拼进生成的源码和 __slots__，返回字段元组
+
+    以 "__" 开头的名字在类体的 __slots__ 中会被改写成 _类名__字段，
+    与生成的 __init__ 写入的名字不一致，所以一并拒绝。
+    """
+    fields = tuple(fields)
+    for field in fields:
+        if not isinstance(field, str) or not field.isidentifier() or keyword.iskeyword(field):
+            raise ValueError(f"无效的字段名: {field!r}")
+        if field.startswith("__") or field in RESERVED_FIELDS:
+            raise ValueError(f"保留的字段名: {field}")
+    if len(set(fields)) != len(fields):
+        raise ValueError(f"字段名重复: {fields}")
+    return fields
+
+
+def compile_function(source, name):
+    """编译生成的函数源码并取出函数对象"""
+    namespace = {}
+    exec(source, {}, namespace)
+    return namespace[name]
+
+
+def build_record_methods(class_name, fields):
+    """根据字段列表生成专用的 __slots__、__init__、__repr__ 和 __eq__
+
+    __init__ 使用显式参数逐个赋值，不再遍历 **kwargs 调用 setattr；
+    __slots__ 让实例不再携带 __dict__。
+    """
+    fields = check_field_names(fields)
+    params = "".join(f", {f}" for f in fields)
+    body = "".join(f"    self.{f} = {f}\n" for f in fields) or "    pass\n"
+    values = "".join(f"self.{f}, " for f in fields)
+    others = "".join(f"other.{f}, " for f in fields)
+    shown = ", ".join(f"{f}={{self.{f}!r}}" for f in fields)
+    return {
+        "__slots__": fields,
+        "_fields": fields,
+        "__init__": compile_function(f"def __init__(self{params}):\n{body}", "__init__"),
+        "__repr__": compile_function(
+            f"def __repr__(self):\n    return f'{class_name}({shown})'\n", "__repr__"),
+        "__eq__": compile_function(
+            "def __eq__(self, other):\n"
+            "    if other.__class__ is not self.__class__:\n"
+            "        return NotImplemented\n"
+            f"    return ({values}) == ({others})\n", "__eq__"),
+    }